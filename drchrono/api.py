@@ -0,0 +1,18 @@
+from django.conf import settings
+
+import requests
+
+
+# build a drchrono API url; the base is configurable so a fake API can stand in for load tests
+def api_url(path):
+    return settings.DRCHRONO_API_URL + path
+
+
+# yield the results on each page of a list endpoint, following `next` until the last page
+def iter_pages(url, auth_header):
+    while url:
+        resp = requests.get(url, headers=auth_header)
+        resp.raise_for_status()
+        data = resp.json()
+        yield data['results']
+        url = data['next']  # a JSON null on the last page
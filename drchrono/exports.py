@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.utils import six
+
+from drchrono.models import Appointment, ArchivedAppointment, Patient
+from drchrono.scheduling import day_bounds
+
+import csv
+import datetime
+import itertools
+import json
+
+APPOINTMENT_FIELDS = (
+    'appointment_id', 'patient_id', 'patient_first_name', 'patient_last_name', 'doctor_id',
+    'scheduled_time', 'arrival_time', 'time_waited_seconds', 'status',
+)
+
+PATIENT_FIELDS = ('patient_id', 'doctor_id', 'first_name', 'last_name', 'gender', 'email')
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_RESOURCES = ('appointments', 'patients')
+
+# archived rows whose patient names are looked up together; kept under SQLite's limit on query parameters
+NAME_LOOKUP_SIZE = 500
+
+
+# walk a queryset in primary key order, one bounded page at a time, so memory doesn't grow with the table
+def iterate_in_chunks(queryset, columns, chunk_size=None):
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('pk')
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', *columns)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+# a doctor's appointments, live then archived, optionally limited to scheduled dates within [start_date, end_date]
+def iter_appointment_rows(doctor_id, start_date=None, end_date=None):
+    live = filter_scheduled(Appointment.objects.filter(doctor_id=doctor_id), start_date, end_date)
+    columns = ('appointment_id', 'patient__patient_id', 'patient__first_name', 'patient__last_name', 'doctor_id',
+               'scheduled_time', 'arrival_time', 'time_waited', 'status')
+    for row in iterate_in_chunks(live, columns):
+        yield dict(zip(APPOINTMENT_FIELDS, row))
+
+    # archived rows only keep the patient id; names are looked up a batch at a time
+    archived = filter_scheduled(ArchivedAppointment.objects.filter(doctor_id=doctor_id), start_date, end_date)
+    columns = ('appointment_id', 'patient_id', 'doctor_id', 'scheduled_time', 'arrival_time', 'time_waited', 'status')
+    rows = iterate_in_chunks(archived, columns)
+    while True:
+        chunk = [dict(zip(columns, row)) for row in itertools.islice(rows, NAME_LOOKUP_SIZE)]
+        if not chunk:
+            return
+        names = dict((patient_id, (first_name, last_name)) for patient_id, first_name, last_name in
+                     Patient.objects.filter(patient_id__in=set(row['patient_id'] for row in chunk))
+                     .values_list('patient_id', 'first_name', 'last_name'))
+        for row in chunk:
+            row['patient_first_name'], row['patient_last_name'] = names.get(row['patient_id'], ('', ''))
+            row['time_waited_seconds'] = row.pop('time_waited')
+            yield row
+
+
+def filter_scheduled(queryset, start_date, end_date):
+    if start_date:
+        queryset = queryset.filter(scheduled_time__gte=day_bounds(start_date)[0])
+    if end_date:
+        queryset = queryset.filter(scheduled_time__lt=day_bounds(end_date)[1])
+    return queryset
+
+
+def iter_patient_rows(doctor_id):
+    for row in iterate_in_chunks(Patient.objects.filter(doctor_id=doctor_id), PATIENT_FIELDS):
+        yield dict(zip(PATIENT_FIELDS, row))
+
+
+def serialize_value(value):
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class Echo(object):
+    """
+    File-like object that hands back what is written to it, so csv.writer can build lines one at a time
+    """
+
+    def write(self, value):
+        return value
+
+
+# yield the export as text lines: a CSV header and rows, or one JSON object per line
+def export_lines(resource, export_format, doctor_id, start_date=None, end_date=None):
+    if resource == 'patients':
+        fields, rows = PATIENT_FIELDS, iter_patient_rows(doctor_id)
+    else:
+        fields, rows = APPOINTMENT_FIELDS, iter_appointment_rows(doctor_id, start_date, end_date)
+
+    if export_format == 'jsonl':
+        for row in rows:
+            yield six.text_type(json.dumps(dict((field, serialize_value(value)) for field, value in row.items()),
+                                           sort_keys=True)) + u'\n'
+    else:
+        writer = csv.writer(Echo())
+        yield csv_line(writer, fields)
+        for row in rows:
+            yield csv_line(writer, [serialize_value(row[field]) for field in fields])
+
+
+# Python 2's csv module only handles byte strings, so values go in as UTF-8 and the line is decoded back to text
+def csv_line(writer, values):
+    if six.PY2:
+        values = [value.encode('utf-8') if isinstance(value, six.text_type) else value for value in values]
+        return writer.writerow(values).decode('utf-8')
+    return writer.writerow(values)
@@ -0,0 +1,424 @@
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer, get_internal_wsgi_application
+from django.db import OperationalError
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from django.utils.six.moves.urllib.parse import parse_qs, urlparse
+from social.apps.django_app.default.models import UserSocialAuth
+
+from drchrono.models import Doctor, Patient, Appointment, Arrival
+
+from collections import defaultdict
+from email.utils import formatdate
+from importlib import import_module
+
+import datetime
+import itertools
+import json
+import logging
+import random
+import re
+import requests
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# fixture doctor ids start here, well clear of real drchrono ids in a dev database
+FIRST_DOCTOR_ID = 900001
+USERNAME_PREFIX = 'loadtest-doctor-'
+API_PAGE_SIZE = 100
+
+
+class FakeDrchronoAPI(object):
+    """
+    In-memory stand-in for the parts of the drchrono API the app uses: one
+    doctor per access token, each with a set of patients who all have an
+    appointment today
+    """
+
+    def __init__(self, doctors, patients_per_doctor, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.tokens = {}
+        self.patients = {}
+        self.appointments = {}
+
+        today = datetime.datetime.utcnow().replace(hour=8, minute=0, second=0, microsecond=0)
+        for doctor_id in range(FIRST_DOCTOR_ID, FIRST_DOCTOR_ID + doctors):
+            self.tokens[self.token_for(doctor_id)] = doctor_id
+            for i in range(patients_per_doctor):
+                patient_id = doctor_id * 10000 + i
+                self.patients[patient_id] = {
+                    'id': patient_id, 'doctor': doctor_id, 'gender': 'Other',
+                    'first_name': 'Kiosk%d' % i, 'last_name': 'Doctor%d' % doctor_id,
+                    'email': 'kiosk%d@example.com' % i, 'cell_phone': '+14155550100',
+                    'zip_code': '94105', 'address': '1 Main St',
+                    'emergency_contact_phone': '+14155550199', 'emergency_contact_name': 'Contact',
+                }
+                self.appointments[str(patient_id)] = {
+                    'id': str(patient_id), 'doctor': doctor_id, 'patient': patient_id, 'status': '',
+                    'duration': 30, 'scheduled_time': (today + datetime.timedelta(minutes=10 * i)).isoformat(),
+                }
+
+    @staticmethod
+    def token_for(doctor_id):
+        return 'loadtest-token-%d' % doctor_id
+
+    def doctor_ids(self):
+        return sorted(self.tokens.values())
+
+    def patients_for(self, doctor_id):
+        return [patient for patient in self.patients.values() if patient['doctor'] == doctor_id]
+
+    # paginate like the real API: {'results': [...], 'next': url or None}
+    def page(self, base_url, query, items):
+        page = int(query.get('page', 1))
+        start = (page - 1) * API_PAGE_SIZE
+        next_url = None
+        if start + API_PAGE_SIZE < len(items):
+            params = dict(query, page=page + 1)
+            next_url = base_url + '?' + '&'.join('%s=%s' % item for item in sorted(params.items()))
+        return 200, {'results': items[start:start + API_PAGE_SIZE], 'next': next_url}
+
+    # route one request; returns (status code, JSON-able body or None)
+    def handle(self, method, url, token, body):
+        if self.latency:
+            time.sleep(self.latency)
+        doctor_id = self.tokens.get(token)
+        if doctor_id is None:
+            return 401, {'detail': 'Invalid token'}
+
+        parsed = urlparse(url)
+        query = dict((key, values[0]) for key, values in parse_qs(parsed.query).items())
+        path = parsed.path.rstrip('/')
+        base_url = 'http://%s%s' % (parsed.netloc, parsed.path)
+        detail = re.match(r'^/api/(patients|appointments)/(\d+)$', path)
+
+        with self.lock:
+            if method == 'GET' and path == '/api/users/current':
+                return 200, {'doctor': doctor_id, 'username': USERNAME_PREFIX + str(doctor_id)}
+            if method == 'GET' and path == '/api/doctors':
+                return self.page(base_url, query, [{'id': doctor_id, 'first_name': 'Load', 'last_name': 'Test',
+                                                    'email': 'doctor@example.com'}])
+            if method == 'GET' and path == '/api/patients':
+                items = [patient for patient in self.patients.values() if patient['doctor'] == doctor_id and
+                         all(str(patient.get(key)) == value for key, value in query.items()
+                             if key in ('doctor', 'first_name', 'last_name'))]
+                return self.page(base_url, query, sorted(items, key=lambda patient: patient['id']))
+            if method == 'GET' and path == '/api/appointments':
+                items = [appointment for appointment in self.appointments.values()
+                         if appointment['doctor'] == doctor_id and
+                         all(str(appointment.get(key)) == value for key, value in query.items()
+                             if key in ('doctor', 'patient'))]
+                return self.page(base_url, query, sorted(items, key=lambda appointment: appointment['id']))
+            if method == 'PATCH' and detail:
+                collection = self.patients if detail.group(1) == 'patients' else self.appointments
+                key = int(detail.group(2)) if detail.group(1) == 'patients' else detail.group(2)
+                if key not in collection:
+                    return 404, {'detail': 'Not found'}
+                collection[key].update(body)
+                return 204, None
+            if method == 'POST' and path == '/api/patients':
+                patient_id = doctor_id * 10000 + 5000 + next(self.ids)
+                self.patients[patient_id] = dict(body, id=patient_id, doctor=doctor_id)
+                return 201, self.patients[patient_id]
+            if method == 'POST' and path == '/api/appointments':
+                appointment_id = str(doctor_id * 10000 + 5000 + next(self.ids))
+                self.appointments[appointment_id] = dict(body, id=appointment_id, status='')
+                return 201, self.appointments[appointment_id]
+        return 404, {'detail': 'Not found'}
+
+
+class FakeAPIRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length).decode('utf-8') if length else ''
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            body = json.loads(raw_body or '{}')
+        else:
+            body = dict((key, values[0]) for key, values in parse_qs(raw_body).items())
+        token = (self.headers.get('Authorization') or '').replace('Bearer ', '', 1)
+        url = 'http://%s%s' % (self.headers.get('Host'), self.path)
+
+        status, payload = self.server.api.handle(self.command, url, token, body)
+        content = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeAPIServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeAPIRequestHandler)
+        self.api = api
+
+
+# Django 1.11's basehttp has no ThreadedWSGIServer; this is the class its runserver builds
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class LockErrorCounter(logging.Handler):
+    """
+    Counts requests that failed because SQLite was locked by another writer
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.count = 0
+
+    def emit(self, record):
+        if record.exc_info and isinstance(record.exc_info[1], OperationalError) and \
+                'locked' in str(record.exc_info[1]):
+            self.count += 1
+
+
+def serve_in_thread(server):
+    thread = threading.Thread(target=server.serve_forever, name='loadtest-server')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+# latencies and outcomes per endpoint, shared by all simulated clients
+class Recorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_errors = 0
+        self.checked_in = 0
+        self.called_in = 0
+
+    def record(self, endpoint, seconds, ok, locked=False):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+            if locked:
+                self.lock_errors += 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[max(index, 0)]
+
+
+class SimulatedClient(object):
+    """
+    A browser logged in as one doctor, timing each request it makes
+    """
+
+    def __init__(self, app_url, session_key, recorder):
+        self.app_url = app_url.rstrip('/')
+        self.recorder = recorder
+        self.http = requests.Session()
+        self.http.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+        self.http.cookies.set('tzname_from_user', settings.TIME_ZONE)
+
+    # make a request, record it under `endpoint` and return the response (None if it couldn't be made)
+    def request(self, endpoint, method, path, expect=None, **kwargs):
+        headers = {'X-CSRFToken': self.http.cookies.get(settings.CSRF_COOKIE_NAME, '')}
+        started = time.time()
+        try:
+            response = self.http.request(method, self.app_url + path, headers=headers, allow_redirects=False,
+                                         timeout=60, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.time() - started, ok=False)
+            return None
+        ok = response.status_code < 400 and (expect is None or expect in response.text)
+        locked = response.status_code >= 500 and 'database is locked' in response.text
+        self.recorder.record(endpoint, time.time() - started, ok, locked)
+        return response if ok else None
+
+
+# a patient check-in kiosk running the check-in -> demographics -> completed flow
+def run_kiosk(client, patients, deadline, think_time):
+    client.request('checkin_page', 'GET', '/checkin/')  # sets the CSRF cookie
+    for patient in itertools.cycle(patients):
+        if time.time() >= deadline:
+            return
+        form = {'first_name': patient['first_name'], 'last_name': patient['last_name'],
+                'social_security_number': '123-45-6789'}
+        if client.request('checkin_patient', 'POST', '/checkin/', data=form, expect='update_demographics_form'):
+            initial = dict((key, patient[key]) for key in ('cell_phone', 'email', 'zip_code', 'address',
+                                                           'emergency_contact_phone', 'emergency_contact_name'))
+            initial.update({'patient_id': patient['id'], 'appointment_id': str(patient['id'])})
+            demographics = dict(initial, initial_form_data=json.dumps(initial))
+            if random.random() < 0.2:  # some patients update their details, which PATCHes upstream
+                demographics['cell_phone'] = '+1415555%04d' % random.randint(0, 9999)
+            if client.request('update_demographics', 'POST', '/demographics/', data=demographics,
+                              expect='Thanks for checking in'):
+                with client.recorder.lock:
+                    client.recorder.checked_in += 1
+        time.sleep(think_time)
+
+
+# a doctor dashboard polling for arrivals, calling each patient in and completing the appointment
+def run_dashboard(client, deadline, poll_interval):
+    client.request('index', 'GET', '/')  # sets the CSRF cookie
+    while time.time() < deadline:
+        response = client.request('poll_for_updates', 'POST', '/poll_for_updates/', expect='"success"')
+        updates = response.json()['updates'] if response is not None else []
+        for appointment_id in updates:
+            with client.recorder.lock:
+                client.recorder.called_in += 1
+            client.request('call_in_patient', 'POST', '/call_in_patient/',
+                           data={'appointment_id': appointment_id, 'current_date_time': formatdate(usegmt=True)})
+            client.request('appointment_completed', 'POST', '/appointment_completed/',
+                           data={'appointment_id': appointment_id})
+        time.sleep(poll_interval)
+
+
+class LoadTest(object):
+    """
+    Runs N kiosks and M dashboards against the app (served in-process unless
+    `app_url` is given) with a fake drchrono API behind it, and reports
+    throughput, latency percentiles, error rates and SQLite lock errors per
+    endpoint
+    """
+
+    def __init__(self, kiosks, dashboards, doctors, patients_per_doctor, duration, think_time=0.5,
+                 poll_interval=1.5, api_latency=0.0, api_port=0, app_url=None):
+        self.kiosks = kiosks
+        self.dashboards = dashboards
+        self.duration = duration
+        self.think_time = think_time
+        self.poll_interval = poll_interval
+        self.api_port = api_port
+        self.app_url = app_url
+        self.api = FakeDrchronoAPI(doctors, patients_per_doctor, api_latency)
+        self.recorder = Recorder()
+        self.session_keys = []
+
+    # fixture doctors mirroring the fake API, each with a drchrono token
+    def create_fixtures(self):
+        for doctor_id in self.api.doctor_ids():
+            user, _ = User.objects.get_or_create(username=USERNAME_PREFIX + str(doctor_id),
+                                                 defaults={'last_name': 'Doctor%d' % doctor_id})
+            UserSocialAuth.objects.update_or_create(
+                user=user, provider='drchrono',
+                defaults={'uid': str(doctor_id), 'extra_data': {'access_token': self.api.token_for(doctor_id)}})
+            Doctor.objects.get_or_create(user=user, defaults={'doctor_id': doctor_id})
+
+    # a logged-in session for the doctor, as if they had gone through OAuth
+    def login(self, doctor_id):
+        user = User.objects.get(username=USERNAME_PREFIX + str(doctor_id))
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        self.session_keys.append(session.session_key)
+        return session.session_key
+
+    def cleanup(self):
+        doctor_ids = self.api.doctor_ids()
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        for session_key in self.session_keys:
+            session_store(session_key).delete()
+        Arrival.objects.filter(doctor_id__in=doctor_ids).delete()
+        Appointment.objects.filter(doctor_id__in=doctor_ids).delete()
+        Patient.objects.filter(doctor_id__in=doctor_ids).delete()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def run(self):
+        api_server = FakeAPIServer(('127.0.0.1', self.api_port), self.api)
+        serve_in_thread(api_server)
+        api_url = 'http://127.0.0.1:%d/api' % api_server.server_address[1]
+        log.info("Fake drchrono API listening on %s", api_url)
+
+        app_server = None
+        lock_counter = LockErrorCounter()
+        app_url = self.app_url
+        if app_url is None:
+            settings.DRCHRONO_API_URL = api_url
+            app_server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+            app_server.set_app(get_internal_wsgi_application())
+            serve_in_thread(app_server)
+            app_url = 'http://127.0.0.1:%d' % app_server.server_address[1]
+            logging.getLogger('django.request').addHandler(lock_counter)
+
+        try:
+            self.create_fixtures()
+            doctor_ids = self.api.doctor_ids()
+
+            # load each doctor's dashboard once so their patients and appointments are synced locally
+            for doctor_id in doctor_ids:
+                SimulatedClient(app_url, self.login(doctor_id), Recorder()).request('warmup', 'GET', '/')
+
+            deadline = time.time() + self.duration
+            threads = []
+            for i in range(self.kiosks):
+                doctor_id = doctor_ids[i % len(doctor_ids)]
+                patients = self.api.patients_for(doctor_id)
+                random.shuffle(patients)
+                client = SimulatedClient(app_url, self.login(doctor_id), self.recorder)
+                threads.append(threading.Thread(target=run_kiosk, args=(client, patients, deadline, self.think_time)))
+            for i in range(self.dashboards):
+                client = SimulatedClient(app_url, self.login(doctor_ids[i % len(doctor_ids)]), self.recorder)
+                threads.append(threading.Thread(target=run_dashboard, args=(client, deadline, self.poll_interval)))
+
+            started = time.time()
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - started
+        finally:
+            if app_server is not None:
+                logging.getLogger('django.request').removeHandler(lock_counter)
+                app_server.shutdown()
+            api_server.shutdown()
+
+        self.recorder.lock_errors = max(self.recorder.lock_errors, lock_counter.count)
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        recorder = self.recorder
+        endpoints = {}
+        total = 0
+        for endpoint, latencies in sorted(recorder.latencies.items()):
+            latencies = sorted(latencies)
+            total += len(latencies)
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'errors': recorder.errors[endpoint],
+                'error_rate': float(recorder.errors[endpoint]) / len(latencies),
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+            }
+        return {
+            'elapsed_seconds': elapsed,
+            'requests': total,
+            'throughput_rps': total / elapsed if elapsed else 0.0,
+            'errors': sum(recorder.errors.values()),
+            'sqlite_lock_errors': recorder.lock_errors,
+            'checked_in': recorder.checked_in,
+            'called_in': recorder.called_in,
+            'endpoints': endpoints,
+        }
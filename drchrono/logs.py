@@ -0,0 +1,194 @@
+from django.conf import settings
+from django.utils import six
+from django.utils.six.moves import queue
+
+import atexit
+import datetime
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+
+REDACTED = '[REDACTED]'
+
+# keys whose values are patient-identifying, wherever they appear in a payload
+PHI_KEYS = (
+    'first_name', 'last_name', 'middle_name', 'nick_name', 'name', 'patient_name',
+    'social_security_number', 'ssn', 'date_of_birth',
+    'email', 'cell_phone', 'home_phone', 'office_phone', 'phone',
+    'address', 'zip_code', 'emergency_contact_name', 'emergency_contact_phone',
+)
+
+# a known key followed by its value: quoted (including Python 2 u'' reprs), or else everything up to the next
+# field delimiter, so unquoted values with spaces such as "Name: Ada Lovelace" are masked in full
+PHI_KEY_VALUE_RE = re.compile(r'''(["']?\b(?:%s)["']?\s*[:=]\s*)(?:u?"[^"]*"?|u?'[^']*'?|[^,;&}\r\n]+)'''
+                              % '|'.join(PHI_KEYS), re.IGNORECASE)
+# SSNs with dashes or spaces, or nine bare digits that are a valid SSN (no 000, 666 or 9xx area, 00 group, 0000 serial)
+SSN_RE = re.compile(r'\b\d{3}[- ]\d{2}[- ]\d{4}\b|\b(?!000|666|9\d\d)\d{3}(?!00)\d{2}(?!0000)\d{4}\b')
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+# phone numbers written with separators or in E.164; bare ten-digit numbers are more often ids
+PHONE_RE = re.compile(r'(?<![\w+])(?:\+?1[\s.-]?)?(?:\(\d{3}\)\s?|\d{3}[\s.-])\d{3}[\s.-]\d{4}\b|\+\d{10,15}\b')
+
+# attributes every LogRecord has; anything else was passed in through `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+# mask PHI in free text: known keys in key/value pairs first, then anything shaped like an SSN, email or phone number
+def redact(text):
+    text = PHI_KEY_VALUE_RE.sub(lambda m: m.group(1) + '"' + REDACTED + '"', text)
+    text = SSN_RE.sub(REDACTED, text)
+    text = EMAIL_RE.sub(REDACTED, text)
+    return PHONE_RE.sub(REDACTED, text)
+
+
+# mask PHI in structured data passed as log `extra` fields
+def redact_value(value, key=None):
+    if key is not None and six.text_type(key).lower() in PHI_KEYS:
+        return REDACTED
+    if isinstance(value, dict):
+        return dict((k, redact_value(v, k)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [redact_value(v) for v in value]
+    if isinstance(value, six.string_types):
+        return redact(value)
+    return value
+
+
+class RedactPHIFilter(logging.Filter):
+    """
+    Rewrites each record's message and extra fields with PHI masked
+    """
+
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        for key in set(vars(record)) - RECORD_ATTRIBUTES:
+            setattr(record, key, redact_value(getattr(record, key), key))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'where': '%s.%s' % (record.module, record.funcName),
+            'message': record.getMessage(),
+        }
+        for key in set(vars(record)) - RECORD_ATTRIBUTES:
+            entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exc_info'] = redact(self.formatException(record.exc_info))
+        elif getattr(record, 'exc_text', None):
+            entry['exc_info'] = redact(record.exc_text)
+        return json.dumps(entry, default=str, sort_keys=True)
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records to a background thread which formats and writes them, so the
+    request thread never blocks on log I/O. Records are dropped (and counted)
+    rather than blocking when the queue is full; the count is written as a
+    warning at most every `report_interval` seconds.
+    """
+
+    def __init__(self, stream=None, maxsize=10000, report_interval=60):
+        logging.Handler.__init__(self)
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.report_interval = report_interval
+        self.reported_at = time.time()
+        self._thread = threading.Thread(target=self._drain, name='drchrono-log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.flush)
+
+    # filters and formatting run on the writer thread, not the request thread
+    def addFilter(self, filter):
+        self.target.addFilter(filter)
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        self.target.setFormatter(fmt)
+
+    # resolve everything that can't safely cross threads; formatting happens on the writer thread
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    # a record that fails to filter or format is reported by handleError and skipped; the writer keeps going
+    def _drain(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.report_interval)
+            except queue.Empty:
+                record = None
+            if record is not None:
+                try:
+                    self.target.handle(record)
+                except Exception:
+                    self.target.handleError(record)
+                finally:
+                    self.queue.task_done()
+            self.report_dropped()
+
+    def report_dropped(self):
+        dropped = self.dropped - self.reported_dropped
+        if not dropped or time.time() - self.reported_at < self.report_interval:
+            return
+        self.reported_dropped += dropped
+        self.reported_at = time.time()
+        record = logging.LogRecord('drchrono.logs', logging.WARNING, __file__, 0,
+                                   "Dropped %d log records; the log queue was full", (dropped,), None,
+                                   'report_dropped')
+        try:
+            self.target.handle(record)
+        except Exception:
+            self.target.handleError(record)
+
+    # block until every queued record has been written
+    def flush(self):
+        self.queue.join()
+        self.target.flush()
+
+
+# log the outcome of an upstream API call; the (redacted, truncated) body is only attached for a sample of calls
+def log_upstream(logger, action, response):
+    details = {
+        'action': action,
+        'method': response.request.method,
+        'url': response.request.url.split('?')[0],
+        'status_code': response.status_code,
+        'elapsed_ms': int(response.elapsed.total_seconds() * 1000),
+    }
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.LOG_UPSTREAM_SAMPLE_RATE:
+        body = response.text
+        max_chars = settings.LOG_UPSTREAM_MAX_CHARS
+        if len(body) > max_chars:
+            body = body[:max_chars] + '...[%d chars truncated]' % (len(body) - max_chars)
+        details['body'] = redact(body)
+        logger.debug("REQ: %s", action, extra={'upstream': details})
+    else:
+        logger.info("REQ: %s", action, extra={'upstream': details})
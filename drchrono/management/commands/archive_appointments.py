@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from drchrono import retention
+
+
+class Command(BaseCommand):
+    help = ("Move completed appointments older than the retention window into the archive, keeping their "
+            "wait times in daily stats, clear out stale arrivals and old webhook events, then vacuum SQLite. "
+            "Safe to interrupt and re-run")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.APPOINTMENT_RETENTION_DAYS,
+                            help='keep completed appointments scheduled within this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='appointments moved per transaction')
+        parser.add_argument('--no-vacuum', action='store_false', dest='vacuum', help="don't vacuum the database")
+
+    def handle(self, *args, **options):
+        archived = retention.archive_appointments(options['days'], options['batch_size'])
+        self.stdout.write('Archived %d appointments' % archived)
+
+        arrivals = retention.delete_stale_arrivals()
+        self.stdout.write('Deleted %d stale arrivals' % arrivals)
+
+        events = retention.delete_old_webhook_events(settings.WEBHOOK_EVENT_RETENTION_DAYS)
+        self.stdout.write('Deleted %d processed webhook events' % events)
+
+        if options['vacuum'] and retention.vacuum():
+            self.stdout.write('Vacuumed database')
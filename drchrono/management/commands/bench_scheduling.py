@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+
+from drchrono.scheduling import SlotIndex
+
+import datetime
+import random
+import time
+
+
+# the straightforward alternative: walk every booking (sorted by start) looking for a long enough gap
+def linear_first_free_slot(opens, closes, busy, duration, not_before):
+    candidate = max(not_before, opens)
+    for start, end in busy:
+        if start - candidate >= duration:
+            break
+        candidate = max(candidate, end)
+    return candidate if closes - candidate >= duration else None
+
+
+# a day of back-to-back bookings; a few gaps are long enough to fit a walk-in
+def busy_calendar(opens, closes, appointments, rng):
+    busy = []
+    cursor = opens
+    step = (closes - opens) / appointments
+    while cursor + step <= closes:
+        if rng.random() < 0.005:
+            cursor += datetime.timedelta(minutes=rng.randint(10, 60))
+            continue
+        length = datetime.timedelta(seconds=rng.randint(int(step.total_seconds() * 0.8), int(step.total_seconds())))
+        busy.append((cursor, cursor + length))
+        cursor += step
+    return busy
+
+
+class Command(BaseCommand):
+    help = "Benchmark walk-in slot lookups against busy multi-doctor calendars, versus a linear scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--appointments', type=int, default=2000, help='bookings per doctor per day')
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--duration', type=int, default=30, help='walk-in length in minutes')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        opens = datetime.datetime(2017, 12, 1, 0, 0)
+        closes = opens + datetime.timedelta(hours=24)
+        duration = datetime.timedelta(minutes=options['duration'])
+
+        calendars = [busy_calendar(opens, closes, options['appointments'], rng) for _ in range(options['doctors'])]
+        started = time.time()
+        indexes = [SlotIndex(opens, closes, busy) for busy in calendars]
+        build_seconds = time.time() - started
+
+        queries = [(rng.randrange(options['doctors']), opens + datetime.timedelta(minutes=rng.randrange(24 * 60)))
+                   for _ in range(options['queries'])]
+
+        started = time.time()
+        indexed = [indexes[doctor].first_free_slot(duration, not_before) for doctor, not_before in queries]
+        indexed_seconds = time.time() - started
+
+        started = time.time()
+        for doctor, not_before in queries:
+            indexes[doctor].conflicts(not_before, not_before + duration)
+        conflict_seconds = time.time() - started
+
+        started = time.time()
+        linear = [linear_first_free_slot(opens, closes, calendars[doctor], duration, not_before)
+                  for doctor, not_before in queries]
+        linear_seconds = time.time() - started
+
+        found = sum(1 for slot in indexed if slot is not None)
+        mismatches = sum(1 for a, b in zip(indexed, linear) if a != b)
+        self.stdout.write('%d doctors x %d bookings, %d queries for a %d minute slot' % (
+            options['doctors'], options['appointments'], options['queries'], options['duration']))
+        self.stdout.write('build indexes:       %8.1f ms total' % (build_seconds * 1000))
+        self.stdout.write('first free (index):  %8.2f us/query' % (indexed_seconds / len(queries) * 1e6))
+        self.stdout.write('first free (linear): %8.2f us/query' % (linear_seconds / len(queries) * 1e6))
+        self.stdout.write('conflict check:      %8.2f us/query' % (conflict_seconds / len(queries) * 1e6))
+        self.stdout.write('queries with a free slot: %d, results differing from linear scan: %d' % (found, mismatches))
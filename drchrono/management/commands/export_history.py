@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from dateutil import parser as date_parser
+
+from drchrono.exports import EXPORT_FORMATS, EXPORT_RESOURCES, export_lines
+
+import io
+
+
+def parse_date(value):
+    try:
+        return date_parser.parse(value).date()
+    except (ValueError, OverflowError):
+        raise CommandError('Not a date: %s' % value)
+
+
+class Command(BaseCommand):
+    help = "Stream a doctor's appointment or patient history as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('doctor_id', type=int)
+        parser.add_argument('--resource', choices=EXPORT_RESOURCES, default='appointments')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', dest='export_format')
+        parser.add_argument('--start', type=parse_date, help='first scheduled date to include, e.g. 2017-01-01')
+        parser.add_argument('--end', type=parse_date, help='last scheduled date to include, e.g. 2017-12-31')
+        parser.add_argument('--output', help='file to write to (defaults to stdout)')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['resource'], options['export_format'], options['doctor_id'],
+                             options['start'], options['end'])
+
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
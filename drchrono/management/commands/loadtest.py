@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from drchrono.loadtest import LoadTest
+
+import json
+
+
+class Command(BaseCommand):
+    help = ("Simulate patient kiosks and doctor dashboards against the app and a fake drchrono API, "
+            "and report throughput, latency percentiles, error rates and SQLite lock errors per endpoint")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kiosks', type=int, default=4, help='concurrent check-in kiosks')
+        parser.add_argument('--dashboards', type=int, default=2, help='concurrent doctor dashboards')
+        parser.add_argument('--doctors', type=int, help='fixture doctors (defaults to one per dashboard)')
+        parser.add_argument('--patients', type=int, default=50, help='patients with an appointment today, per doctor')
+        parser.add_argument('--duration', type=float, default=60, help='seconds to run for')
+        parser.add_argument('--think-time', type=float, default=0.5, help='seconds a kiosk waits between patients')
+        parser.add_argument('--poll-interval', type=float, default=1.5, help='seconds between dashboard polls')
+        parser.add_argument('--api-latency', type=float, default=0.0, help='seconds the fake API waits per call')
+        parser.add_argument('--api-port', type=int, default=0,
+                            help='port for the fake API (random by default); fixed when testing an external app')
+        parser.add_argument('--app-url', help='test an already running app, started with DRCHRONO_API_URL pointing '
+                                              'at the fake API, instead of serving it in-process')
+        parser.add_argument('--json', action='store_true', help='print the report as JSON')
+        parser.add_argument('--keep-data', action='store_true', help="don't delete fixture doctors and patients")
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(kiosks=options['kiosks'], dashboards=options['dashboards'],
+                             doctors=options['doctors'] or max(options['dashboards'], 1),
+                             patients_per_doctor=options['patients'], duration=options['duration'],
+                             think_time=options['think_time'], poll_interval=options['poll_interval'],
+                             api_latency=options['api_latency'], api_port=options['api_port'],
+                             app_url=options['app_url'])
+        try:
+            report = load_test.run()
+        finally:
+            if not options['keep_data']:
+                load_test.cleanup()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write('%d requests in %.1fs: %.1f req/s, %d errors, %d SQLite lock errors' % (
+            report['requests'], report['elapsed_seconds'], report['throughput_rps'], report['errors'],
+            report['sqlite_lock_errors']))
+        self.stdout.write('%d patients checked in, %d called in by dashboards' % (
+            report['checked_in'], report['called_in']))
+        self.stdout.write('')
+        self.stdout.write('%-24s %9s %8s %10s %10s %10s' % ('endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms',
+                                                            'p99 ms'))
+        for endpoint, stats in sorted(report['endpoints'].items()):
+            self.stdout.write('%-24s %9d %7.1f%% %10.1f %10.1f %10.1f' % (
+                endpoint, stats['requests'], stats['error_rate'] * 100, stats['p50_ms'], stats['p95_ms'],
+                stats['p99_ms']))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from drchrono import prefetch
+from drchrono.models import Doctor
+
+import logging
+import requests
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Load every doctor's appointments from today through the next few days into the database, so the "
+            "first dashboard load and kiosk check-ins of the day find them there. Run it before opening")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='days after today to load (defaults to SCHEDULE_PREFETCH_DAYS)')
+
+    def handle(self, *args, **options):
+        today = timezone.localtime(timezone.now()).date()
+        # one prefetch covers a doctor's whole practice, which marks the other doctors in it warm
+        for doctor in Doctor.objects.select_related('user'):
+            if prefetch.is_window_warm(doctor.doctor_id, today):
+                continue
+            social_auth = doctor.user.social_auth.filter(provider='drchrono').first()
+            if social_auth is None:
+                continue
+            auth_header = {'Authorization': 'Bearer ' + social_auth.extra_data['access_token']}
+            # an expired or revoked token only skips that doctor
+            try:
+                count = prefetch.prefetch_window(doctor.doctor_id, auth_header, today, options['days'])
+            except requests.HTTPError as e:
+                log.warning("Could not prefetch the schedule using doctor %s: %s", doctor.doctor_id, e)
+                self.stderr.write('Could not prefetch using doctor %s: %s' % (doctor.doctor_id, e))
+                continue
+            self.stdout.write('Prefetched %d appointments using doctor %s' % (count, doctor.doctor_id))
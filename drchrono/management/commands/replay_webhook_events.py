@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drchrono import webhooks
+
+import io
+import json
+
+
+class Command(BaseCommand):
+    help = ("Record webhook events from JSON fixture files, as if drchrono had delivered them, and apply "
+            "everything pending. With no files, just applies pending events")
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures', nargs='*',
+                            help='JSON files holding a list of {"id", "event", "payload"} objects, '
+                                 'e.g. drchrono/fixtures/webhooks/sample_day.json')
+        parser.add_argument('--batch-size', type=int, help='events applied per transaction')
+
+    def handle(self, *args, **options):
+        recorded = duplicates = 0
+        for path in options['fixtures']:
+            try:
+                with io.open(path, encoding='utf-8') as fixture:
+                    events = json.load(fixture)
+            except (IOError, ValueError) as e:
+                raise CommandError('Could not read %s: %s' % (path, e))
+
+            for event in events:
+                body = json.dumps(event['payload'], sort_keys=True).encode('utf-8')
+                event_id = webhooks.get_event_id(event['event'], body, event.get('id'))
+                if webhooks.record_event(event_id, event['event'], event['payload']):
+                    recorded += 1
+                else:
+                    duplicates += 1
+
+        applied = webhooks.apply_pending_events(options['batch_size'])
+        self.stdout.write('Recorded %d events (%d duplicates skipped), applied %d' % (recorded, duplicates, applied))
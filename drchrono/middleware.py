@@ -0,0 +1,80 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from drchrono.models import Doctor
+
+import datetime
+import pytz
+
+PRACTICE_SESSION_KEY = '_practice_context'
+
+
+class PracticeContext(object):
+    """
+    The logged-in doctor's drchrono id, API token and local timezone
+    """
+
+    def __init__(self, doctor_id, access_token, timezone_name):
+        self.doctor_id = doctor_id
+        self.access_token = access_token
+        self.timezone_name = timezone_name
+
+    @property
+    def timezone(self):
+        return pytz.timezone(self.timezone_name)
+
+    # a fresh dict on every access, since callers add their own headers to it
+    @property
+    def auth_header(self):
+        return {'Authorization': 'Bearer ' + self.access_token}
+
+    def now(self):
+        return datetime.datetime.now(self.timezone)
+
+
+# read the timezone set by index.js, falling back to UTC if it's missing or unknown
+def get_timezone_name(request):
+    timezone_name = request.COOKIES.get('tzname_from_user', 'UTC')
+    return timezone_name if timezone_name in pytz.all_timezones_set else 'UTC'
+
+
+# load doctor id and token from the session, hitting the DB only the first time in a session
+def get_practice_context(request):
+    if not request.user.is_authenticated():
+        return None
+
+    cached = request.session.get(PRACTICE_SESSION_KEY)
+    if cached is None:
+        access_token = request.user.social_auth.get(provider='drchrono').extra_data['access_token']
+        doctor_id = Doctor.objects.filter(user=request.user).values_list('doctor_id', flat=True).first()
+        cached = {'doctor_id': doctor_id, 'access_token': access_token}
+        if doctor_id is not None:  # not cached until index() has registered the doctor
+            request.session[PRACTICE_SESSION_KEY] = cached
+
+    return PracticeContext(cached['doctor_id'], cached['access_token'], get_timezone_name(request))
+
+
+# record a doctor id resolved after the context was built (first login)
+def set_practice_doctor_id(request, doctor_id):
+    request.practice.doctor_id = doctor_id
+    request.session[PRACTICE_SESSION_KEY] = {'doctor_id': doctor_id, 'access_token': request.practice.access_token}
+
+
+# a new login brings a new token, so drop anything cached from before it
+@receiver(user_logged_in)
+def clear_practice_context(sender, request, user, **kwargs):
+    request.session.pop(PRACTICE_SESSION_KEY, None)
+
+
+class PracticeContextMiddleware(MiddlewareMixin):
+    """
+    Attaches `request.practice`, resolved lazily at most once per request
+    and cached in the session afterwards. A kiosk request still loads the
+    session (unless sessions are read through a shared cache) and the
+    logged-in user, which AuthenticationMiddleware does on every request
+    """
+
+    def process_request(self, request):
+        request.practice = SimpleLazyObject(lambda: get_practice_context(request))
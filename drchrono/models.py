@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from localflavor.us.models import USSocialSecurityNumberField
 from phonenumber_field.modelfields import PhoneNumberField
 
+import datetime
+
 
 class Doctor(models.Model):
     user = models.OneToOneField(User)
@@ -44,6 +46,13 @@ class Appointment(models.Model):
     arrival_time = models.DateTimeField(auto_now=False, auto_now_add=False, null=True, default=None)
     time_waited = models.DurationField(null=True)
     status = models.CharField(max_length=100, default='')
+    duration = models.IntegerField(null=True)  # minutes
+
+    class Meta:
+        index_together = (
+            ('doctor_id', 'scheduled_time'),
+            ('doctor_id', 'status'),
+        )
 
     def __str__(self):
         return 'Appointment :: Patient name: %s %s, Scheduled time: %s' % (self.patient.first_name,
@@ -51,9 +60,58 @@ class Appointment(models.Model):
                                                                            str(self.scheduled_time))
 
 
+class ArchivedAppointment(models.Model):
+    """
+    A completed appointment moved out of the Appointment table by the archive_appointments command
+    """
+    appointment_id = models.CharField(unique=True, max_length=100)
+    patient_id = models.IntegerField()
+    doctor_id = models.IntegerField()
+    scheduled_time = models.DateTimeField(null=True)
+    arrival_time = models.DateTimeField(null=True)
+    time_waited = models.DurationField(null=True)
+    status = models.CharField(max_length=100, default='')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = (('doctor_id', 'scheduled_time'),)
+
+    def __str__(self):
+        return 'ArchivedAppointment :: Appointment ID: %s, Scheduled time: %s' % (self.appointment_id,
+                                                                                 str(self.scheduled_time))
+
+
+class WaitTimeStat(models.Model):
+    """
+    Daily wait time totals for a doctor's archived appointments, so averages still cover them
+    """
+    doctor_id = models.IntegerField()
+    date = models.DateField()
+    waited_count = models.IntegerField(default=0)
+    total_time_waited = models.DurationField(default=datetime.timedelta())
+
+    class Meta:
+        unique_together = ('doctor_id', 'date')
+
+    def __str__(self):
+        return 'WaitTimeStat :: Doctor ID: %s, Date: %s' % (self.doctor_id, str(self.date))
+
+
 class Arrival(models.Model):
     appointment_id = models.CharField(unique=True, max_length=100)
     doctor_id = models.IntegerField()
 
     def __str__(self):
         return 'Arrival :: Appointment ID: %s' % self.appointment_id
+
+
+class WebhookEvent(models.Model):
+    event_id = models.CharField(unique=True, max_length=100)
+    event_type = models.CharField(max_length=50)
+    payload = models.TextField(blank=True)  # emptied once the event has been applied; kept if it failed
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed = models.BooleanField(default=False, db_index=True)
+    failed = models.BooleanField(default=False)
+
+    def __str__(self):
+        return 'WebhookEvent :: %s %s' % (self.event_type, self.event_id)
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from drchrono.api import api_url, iter_pages
+from drchrono.models import Appointment
+from drchrono.scheduling import day_bounds
+from drchrono.webhooks import apply_appointment_changes, apply_patient_changes
+
+from collections import OrderedDict
+
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+# appointments deleted per transaction; kept under SQLite's limit on query parameters
+DELETE_CHUNK_SIZE = 500
+
+
+def window_key(doctor_id, date):
+    return 'schedule_window:%s:%s' % (doctor_id, date.isoformat())
+
+
+# whether the doctor's schedule starting at `date` was loaded recently enough to be served from the database
+def is_window_warm(doctor_id, date):
+    return cache.get(window_key(doctor_id, date)) is not None
+
+
+# sync patients changed since the last prefetch with this token (all of them the first time)
+def prefetch_patients(doctor_id, auth_header):
+    key = 'patients_synced_at:%s' % doctor_id
+    since = cache.get(key)
+    synced_at = timezone.now()
+
+    url = api_url('/patients')
+    if since:
+        url += '?since=' + since
+    count = 0
+    for page in iter_pages(url, auth_header):
+        with transaction.atomic():
+            apply_patient_changes(OrderedDict((str(patient['id']), (False, patient)) for patient in page))
+        count += len(page)
+
+    cache.set(key, timezone.localtime(synced_at).strftime('%Y-%m-%dT%H:%M:%S'), None)
+    return count
+
+
+# load every appointment in the practice from `start_date` through `days` days after it with date range queries,
+# store them locally, drop local ones the API no longer returns and mark the window warm for each doctor seen.
+# Returns the number of appointments stored
+def prefetch_window(doctor_id, auth_header, start_date, days=None):
+    days = settings.SCHEDULE_PREFETCH_DAYS if days is None else days
+    end_date = start_date + datetime.timedelta(days=days)
+
+    prefetch_patients(doctor_id, auth_header)
+
+    url = api_url('/appointments?date_range=%s/%s' % (start_date.isoformat(), end_date.isoformat()))
+    appointment_ids, doctor_ids = store_appointment_pages(url, auth_header)
+    doctor_ids.add(doctor_id)
+    deleted = delete_missing_appointments(doctor_ids, day_bounds(start_date)[0], day_bounds(end_date)[1],
+                                          appointment_ids)
+
+    for seen_doctor_id in doctor_ids:
+        cache.set(window_key(seen_doctor_id, start_date), True, settings.SCHEDULE_PREFETCH_TTL)
+    log.info("Prefetched %d appointments for %d doctors from %s to %s, removed %d",
+             len(appointment_ids), len(doctor_ids), start_date, end_date, deleted)
+    return len(appointment_ids)
+
+
+# store each page of appointments from the API; returns the ids stored and the doctors they belong to
+def store_appointment_pages(url, auth_header):
+    appointment_ids = set()
+    doctor_ids = set()
+    for page in iter_pages(url, auth_header):
+        with transaction.atomic():
+            apply_appointment_changes(OrderedDict((str(appointment['id']), (False, appointment))
+                                                  for appointment in page))
+        appointment_ids.update(str(appointment['id']) for appointment in page)
+        doctor_ids.update(appointment['doctor'] for appointment in page)
+    return appointment_ids, doctor_ids
+
+
+# remove the doctors' local appointments scheduled within [start, end) that the API didn't return, i.e. ones
+# deleted upstream or moved out of the range; returns how many were removed
+def delete_missing_appointments(doctor_ids, start, end, seen_ids):
+    local_ids = Appointment.objects.filter(doctor_id__in=doctor_ids, scheduled_time__gte=start,
+                                           scheduled_time__lt=end).values_list('appointment_id', flat=True)
+    missing = sorted(set(local_ids) - set(seen_ids))
+    for i in range(0, len(missing), DELETE_CHUNK_SIZE):
+        with transaction.atomic():
+            apply_appointment_changes(OrderedDict((appointment_id, (True, None))
+                                                  for appointment_id in missing[i:i + DELETE_CHUNK_SIZE]))
+    return len(missing)
+
+
+# reload one doctor's appointments on a date from the API, e.g. after upstream refused a booking because of one
+# the database hasn't seen yet
+def refresh_day(doctor_id, auth_header, date):
+    url = api_url('/appointments?doctor=%s&date=%s' % (doctor_id, date.isoformat()))
+    appointment_ids, _ = store_appointment_pages(url, auth_header)
+    day_start, day_end = day_bounds(date)
+    deleted = delete_missing_appointments([doctor_id], day_start, day_end, appointment_ids)
+    log.info("Refreshed %d appointments for doctor %s on %s, removed %d",
+             len(appointment_ids), doctor_id, date, deleted)
@@ -0,0 +1,181 @@
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from collections import Counter
+
+import cProfile
+import datetime
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# <timestamp>-<view name>-<milliseconds>ms.<folded|prof>
+PROFILE_NAME_RE = re.compile(r'^(?P<time>\d{8}T\d{12})-(?P<view>[\w.]+)-(?P<ms>\d+)ms\.(?P<format>folded|prof)$')
+
+
+class StackSampler(object):
+    """
+    Samples one thread's stack at a fixed interval from a background thread,
+    counting identical stacks. Wall-clock sampling, so time blocked on the
+    database or upstream API shows up as well as time on the CPU
+    """
+
+    extension = 'folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.target = None
+        self.stopping = threading.Event()
+
+    def run(self, func, *args, **kwargs):
+        self.target = threading.current_thread().ident
+        sampler = threading.Thread(target=self._sample, name='drchrono-profiler')
+        sampler.daemon = True
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stopping.set()
+            sampler.join()
+
+    def _sample(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    # one "root;...;leaf count" line per distinct stack, as read by flamegraph.pl and speedscope
+    def save(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.stacks.most_common():
+                output.write('%s %d\n' % (stack, count))
+
+
+class DeterministicProfiler(object):
+    """
+    cProfile of the view, saved in pstats format (read by snakeviz, flameprof and friends)
+    """
+
+    extension = 'prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def run(self, func, *args, **kwargs):
+        return self.profile.runcall(func, *args, **kwargs)
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+# module:function:line, with the path shortened to the project or installed package it belongs to
+def frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[-1]
+    return '%s:%s:%d' % (filename.replace(' ', '_'), code.co_name, code.co_firstlineno)
+
+
+# staff can ask for a profile with an `X-Profile: 1` header or `?__profile=1`; other requests are sampled
+def should_profile(request):
+    if not settings.PROFILING_ENABLED:
+        return False
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff and \
+            (request.META.get('HTTP_X_PROFILE') == '1' or request.GET.get('__profile') == '1'):
+        return True
+    return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def save_profile(profiler, view_name, elapsed):
+    if not os.path.isdir(settings.PROFILE_DIR):
+        os.makedirs(settings.PROFILE_DIR)
+    name = '%s-%s-%dms.%s' % (datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f'), re.sub(r'[^\w.]', '_', view_name),
+                              elapsed * 1000, profiler.extension)
+    profiler.save(os.path.join(settings.PROFILE_DIR, name))
+    delete_old_profiles()
+    return name
+
+
+# captures in PROFILE_DIR, newest first
+def list_profiles():
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(settings.PROFILE_DIR), reverse=True):
+        match = PROFILE_NAME_RE.match(name)
+        if match:
+            profiles.append({
+                'name': name,
+                'view': match.group('view'),
+                'ms': int(match.group('ms')),
+                'format': match.group('format'),
+                'captured_at': datetime.datetime.strptime(match.group('time'), '%Y%m%dT%H%M%S%f'),
+                'size': os.path.getsize(os.path.join(settings.PROFILE_DIR, name)),
+            })
+    return profiles
+
+
+# keep only the newest PROFILE_MAX_FILES captures
+def delete_old_profiles():
+    for profile in list_profiles()[settings.PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(settings.PROFILE_DIR, profile['name']))
+        except OSError:
+            pass  # another process got there first
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Profiles the view for requests picked by `should_profile`, saving the
+    capture to PROFILE_DIR and naming it in an X-Profile-Name response
+    header. Must come last in MIDDLEWARE_CLASSES, since it calls the view
+    itself. Streaming responses aren't saved: their body is generated after
+    the view returns, outside the profile
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not should_profile(request):
+            return None
+
+        if settings.PROFILER == 'cprofile':
+            profiler = DeterministicProfiler()
+        else:
+            profiler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+        view_name = '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', 'view'))
+
+        started = time.time()
+        try:
+            response = profiler.run(view_func, request, *view_args, **view_kwargs)
+        except Exception:
+            self.save(profiler, view_name, time.time() - started)
+            raise
+        if getattr(response, 'streaming', False):
+            return response
+
+        name = self.save(profiler, view_name, time.time() - started)
+        if name:
+            response['X-Profile-Name'] = name
+        return response
+
+    # a capture that can't be written (e.g. PROFILE_DIR isn't writable or the disk is full) is logged, never raised
+    def save(self, profiler, view_name, elapsed):
+        try:
+            return save_profile(profiler, view_name, elapsed)
+        except Exception:
+            log.exception("Could not save the profile of %s", view_name)
+            return None
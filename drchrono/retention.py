@@ -0,0 +1,88 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from drchrono.models import Appointment, ArchivedAppointment, Arrival, WaitTimeStat, WebhookEvent
+
+from collections import defaultdict
+
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+ARCHIVED_FIELDS = ('appointment_id', 'doctor_id', 'scheduled_time', 'arrival_time', 'time_waited', 'status')
+
+
+# move one batch of completed appointments scheduled before `cutoff` into the archive, folding their wait times
+# into the daily stats. Each batch commits on its own, so an interrupted run picks up where it stopped.
+# Returns the number of appointments archived
+def archive_batch(cutoff, batch_size):
+    with transaction.atomic():
+        batch = list(Appointment.objects.filter(status='Complete', scheduled_time__lt=cutoff)
+                     .select_related('patient').order_by('pk')[:batch_size])
+        if not batch:
+            return 0
+
+        already_archived = set(ArchivedAppointment.objects.filter(
+            appointment_id__in=[appointment.appointment_id for appointment in batch]
+        ).values_list('appointment_id', flat=True))
+
+        archived = []
+        waits = defaultdict(lambda: [0, datetime.timedelta()])
+        for appointment in batch:
+            if appointment.appointment_id in already_archived:
+                continue
+            archived.append(ArchivedAppointment(patient_id=appointment.patient.patient_id,
+                                                **dict((field, getattr(appointment, field))
+                                                       for field in ARCHIVED_FIELDS)))
+            if appointment.time_waited is not None:
+                day = timezone.localtime(appointment.scheduled_time).date()
+                waits[(appointment.doctor_id, day)][0] += 1
+                waits[(appointment.doctor_id, day)][1] += appointment.time_waited
+
+        ArchivedAppointment.objects.bulk_create(archived)
+        for (doctor_id, day), (count, total) in waits.items():
+            stat, _ = WaitTimeStat.objects.select_for_update().get_or_create(doctor_id=doctor_id, date=day)
+            stat.waited_count += count
+            stat.total_time_waited += total
+            stat.save()
+
+        appointment_ids = [appointment.appointment_id for appointment in batch]
+        Arrival.objects.filter(appointment_id__in=appointment_ids).delete()
+        Appointment.objects.filter(pk__in=[appointment.pk for appointment in batch]).delete()
+        return len(batch)
+
+
+def archive_appointments(retention_days, batch_size):
+    cutoff = timezone.now() - datetime.timedelta(days=retention_days)
+    total = 0
+    while True:
+        archived = archive_batch(cutoff, batch_size)
+        if not archived:
+            return total
+        total += archived
+        log.info("Archived %d appointments (%d so far)", archived, total)
+
+
+# arrivals are only meaningful while their appointment is waiting to be called in
+def delete_stale_arrivals():
+    waiting = Appointment.objects.filter(status='Arrived').values('appointment_id')
+    deleted, _ = Arrival.objects.exclude(appointment_id__in=waiting).delete()
+    return deleted
+
+
+# processed events are only kept long enough to recognise redeliveries
+def delete_old_webhook_events(retention_days):
+    cutoff = timezone.now() - datetime.timedelta(days=retention_days)
+    deleted, _ = WebhookEvent.objects.filter(processed=True, received_at__lt=cutoff).delete()
+    return deleted
+
+
+# give space freed by deleted rows back to the filesystem and refresh the query planner's statistics
+def vacuum():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM')
+        cursor.execute('ANALYZE')
+    return True
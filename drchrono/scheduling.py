@@ -0,0 +1,176 @@
+from django.conf import settings
+from django.utils import timezone
+
+from drchrono.models import Appointment
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+import datetime
+import threading
+import time
+
+# appointments in these states don't hold their slot
+FREED_STATUSES = ('Cancelled', 'Rescheduled')
+
+
+class GapTree(object):
+    """
+    Max segment tree over free gap lengths, answering "first gap at or after
+    index i that is at least this long" in O(log n)
+    """
+
+    def __init__(self, lengths):
+        self.size = 1
+        while self.size < max(len(lengths), 1):
+            self.size *= 2
+        self.tree = [-1] * (2 * self.size)
+        self.tree[self.size:self.size + len(lengths)] = lengths
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def first_at_least(self, start, length, node=1, node_lo=0, node_hi=None):
+        if node_hi is None:
+            node_hi = self.size
+        if node_hi <= start or self.tree[node] < length:
+            return None
+        if node >= self.size:
+            return node - self.size
+        middle = (node_lo + node_hi) // 2
+        found = self.first_at_least(start, length, 2 * node, node_lo, middle)
+        if found is None:
+            found = self.first_at_least(start, length, 2 * node + 1, middle, node_hi)
+        return found
+
+
+class SlotIndex(object):
+    """
+    One doctor's booked intervals for a day, kept merged and sorted between
+    opening and closing time. Conflict checks bisect the busy list and free
+    slot searches descend a segment tree over the gaps, both in O(log n);
+    adding a booking rebuilds the index in O(n)
+    """
+
+    def __init__(self, opens, closes, busy=()):
+        self.opens = opens
+        self.closes = closes
+        self._build(busy)
+
+    def _build(self, busy):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(busy):
+            start, end = max(start, self.opens), min(end, self.closes)
+            if start >= end:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+        self.gap_starts = [self.opens] + self.ends
+        self.gap_ends = self.starts + [self.closes]
+        self.gaps = GapTree([max((end - start).total_seconds(), 0)
+                             for start, end in zip(self.gap_starts, self.gap_ends)])
+
+    # whether [start, end) overlaps a booking or falls outside opening hours
+    def conflicts(self, start, end):
+        if start < self.opens or end > self.closes:
+            return True
+        i = bisect_left(self.starts, end)
+        return i > 0 and self.ends[i - 1] > start
+
+    # the earliest start time, no earlier than `not_before`, with `duration` free after it; None if the day is full
+    def first_free_slot(self, duration, not_before=None):
+        not_before = max(not_before or self.opens, self.opens)
+        i = bisect_right(self.gap_ends, not_before)
+        if i == len(self.gap_ends):
+            return None
+
+        # the gap `not_before` falls in may be cut short; every gap after it is free in full
+        start = max(self.gap_starts[i], not_before)
+        if self.gap_ends[i] - start >= duration:
+            return start
+        i = self.gaps.first_at_least(i + 1, duration.total_seconds())
+        return self.gap_starts[i] if i is not None else None
+
+    def add(self, start, end):
+        self._build(list(zip(self.starts, self.ends)) + [(start, end)])
+
+
+def parse_office_time(value, default):
+    try:
+        return datetime.datetime.strptime(value, '%H:%M:%S').time()
+    except (TypeError, ValueError):
+        return datetime.datetime.strptime(default, '%H:%M').time()
+
+
+# the current time in the office's timezone (TIME_ZONE, the one drchrono's naive appointment times are read in),
+# whatever timezone the browser reports, so walk-ins are never offered a slot that has passed at the office
+def office_now():
+    return timezone.localtime(timezone.now(), timezone.get_default_timezone())
+
+
+# opening and closing time for a date, in the office's timezone
+def office_hours_on(office, date):
+    opens = parse_office_time(office.get('start_time'), settings.DEFAULT_OFFICE_HOURS[0])
+    closes = parse_office_time(office.get('end_time'), settings.DEFAULT_OFFICE_HOURS[1])
+    return (timezone.make_aware(datetime.datetime.combine(date, opens), timezone.get_default_timezone()),
+            timezone.make_aware(datetime.datetime.combine(date, closes), timezone.get_default_timezone()))
+
+
+# the start and end of a date in the current timezone, for filtering on scheduled_time with a half-open range.
+# A __date lookup wraps the column in a function on SQLite, so the (doctor_id, scheduled_time) index can't serve it
+def day_bounds(date):
+    start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min))
+    return start, end
+
+
+def busy_intervals(doctor_id, date):
+    day_start, day_end = day_bounds(date)
+    appointments = Appointment.objects.filter(doctor_id=doctor_id, scheduled_time__gte=day_start,
+                                              scheduled_time__lt=day_end) \
+        .exclude(status__in=FREED_STATUSES).values_list('scheduled_time', 'duration')
+    default = settings.APPOINTMENT_DEFAULT_DURATION
+    return [(start, start + datetime.timedelta(minutes=duration or default)) for start, duration in appointments]
+
+
+class SlotIndexCache(object):
+    """
+    Per-process slot indexes keyed by doctor and date, rebuilt from the
+    Appointment table once they are SLOT_INDEX_TTL seconds old. Bookings for
+    a doctor are serialised, so two kiosks can't be offered the same slot
+    """
+
+    def __init__(self):
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.doctor_locks = defaultdict(threading.Lock)
+
+    def doctor_lock(self, doctor_id):
+        with self.lock:
+            return self.doctor_locks[doctor_id]
+
+    def get(self, doctor_id, date, office):
+        built_at, index = self.indexes.get((doctor_id, date), (0, None))
+        if index is None or time.time() - built_at > settings.SLOT_INDEX_TTL:
+            opens, closes = office_hours_on(office, date)
+            index = SlotIndex(opens, closes, busy_intervals(doctor_id, date))
+            self.indexes[(doctor_id, date)] = (time.time(), index)
+        return index
+
+    def invalidate(self, doctor_id, date):
+        self.indexes.pop((doctor_id, date), None)
+
+
+slot_indexes = SlotIndexCache()
+
+
+# round up to the next slot boundary, so walk-ins are offered times like 10:35 rather than 10:32:17
+def next_slot_boundary(moment):
+    step = settings.SLOT_GRANULARITY_MINUTES * 60
+    moment = moment.replace(microsecond=0)
+    seconds = moment.hour * 3600 + moment.minute * 60 + moment.second
+    return moment + datetime.timedelta(seconds=-seconds % step)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 """
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
+import datetime
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -47,9 +48,11 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'drchrono.middleware.PracticeContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'drchrono.profiling.ProfilingMiddleware',  # calls the view itself, so must stay last
 )
 
 AUTHENTICATION_BACKENDS = (
@@ -91,6 +94,61 @@ DATABASES = {
 }
 
 
+# Cache and sessions
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+# Sessions are read through the cache, so a kiosk hit doesn't need a session query, but only when the cache is
+# shared between processes (e.g. memcached): with a per-process cache, logging out in one process would leave the
+# session cached and logged in in the others.
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+SHARED_CACHE = CACHE_BACKEND not in ('django.core.cache.backends.locmem.LocMemCache',
+                                     'django.core.cache.backends.dummy.DummyCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'drchrono'),
+    }
+}
+
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db' if SHARED_CACHE
+                           else 'django.contrib.sessions.backends.db')
+
+
+# rows fetched per query when streaming history exports
+EXPORT_CHUNK_SIZE = 2000
+
+
+# archive_appointments moves completed appointments scheduled more than APPOINTMENT_RETENTION_DAYS ago out of the
+# Appointment table, ARCHIVE_BATCH_SIZE per transaction, and drops processed webhook events kept for deduplication
+APPOINTMENT_RETENTION_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+WEBHOOK_EVENT_RETENTION_DAYS = 7
+
+
+# Walk-in scheduling: offices without hours in the API use DEFAULT_OFFICE_HOURS, and appointments without a
+# duration are taken to last APPOINTMENT_DEFAULT_DURATION minutes. Walk-ins are booked for WALKIN_DURATION minutes,
+# starting on a SLOT_GRANULARITY_MINUTES boundary. Each process rebuilds its slot index after SLOT_INDEX_TTL seconds
+DEFAULT_OFFICE_HOURS = ('09:00', '17:00')
+OFFICE_CACHE_SECONDS = 12 * 60 * 60
+APPOINTMENT_DEFAULT_DURATION = 30
+WALKIN_DURATION = 30
+SLOT_GRANULARITY_MINUTES = 5
+SLOT_INDEX_TTL = 60
+
+
+# Per-request profiling. When enabled, staff can profile a request with an `X-Profile: 1` header or `?__profile=1`,
+# and PROFILE_SAMPLE_RATE of all requests are profiled. PROFILER is 'sample' (wall-clock stack sampling every
+# PROFILE_SAMPLE_INTERVAL seconds, saved as folded stacks) or 'cprofile' (saved as pstats). The newest
+# PROFILE_MAX_FILES captures are kept in PROFILE_DIR and listed at /profiles/
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '') == 'true'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILER = os.getenv('PROFILER', 'sample')
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_MAX_FILES = 100
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
@@ -110,6 +168,71 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+DRCHRONO_API_URL = os.getenv('DRCHRONO_API_URL', 'https://drchrono.com/api')
+
+# Webhooks are enabled by setting the secret configured for this app's webhook on drchrono. Events are applied
+# once WEBHOOK_BATCH_SIZE are pending or the oldest has waited WEBHOOK_BATCH_MAX_DELAY, and on every dashboard poll.
+DRCHRONO_WEBHOOK_SECRET = os.getenv('DRCHRONO_WEBHOOK_SECRET', '')
+DRCHRONO_WEBHOOKS_ENABLED = bool(DRCHRONO_WEBHOOK_SECRET)
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_BATCH_MAX_DELAY = datetime.timedelta(seconds=5)
+
+# The dashboard serves the practice's schedule for today through SCHEDULE_PREFETCH_DAYS days ahead from the database,
+# reloading it from the API once SCHEDULE_PREFETCH_TTL seconds old; webhooks keep it current in between
+SCHEDULE_PREFETCH_DAYS = 7
+SCHEDULE_PREFETCH_TTL = 24 * 60 * 60 if DRCHRONO_WEBHOOKS_ENABLED else 60
+
 SOCIAL_AUTH_DRCHRONO_KEY = os.getenv('SOCIAL_AUTH_DRCHRONO_KEY')
 SOCIAL_AUTH_DRCHRONO_SECRET = os.getenv('SOCIAL_AUTH_DRCHRONO_SECRET')
 LOGIN_REDIRECT_URL = '/'
+
+
+# Logging
+# https://docs.djangoproject.com/en/1.8/topics/logging/
+# Records are written as JSON lines by a background thread, with PHI masked before they are formatted.
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# fraction of upstream API calls whose (redacted) response body is logged at DEBUG, and the cap on its length
+LOG_UPSTREAM_SAMPLE_RATE = float(os.getenv('LOG_UPSTREAM_SAMPLE_RATE', '0.01'))
+LOG_UPSTREAM_MAX_CHARS = 2048
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'redact_phi': {
+            '()': 'drchrono.logs.RedactPHIFilter',
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'drchrono.logs.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'queue': {
+            'class': 'drchrono.logs.QueueHandler',
+            'stream': 'ext://sys.stderr',
+            'filters': ['redact_phi'],
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'drchrono': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'social_auth_drchrono': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
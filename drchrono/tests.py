@@ -1,3 +1,529 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.db import OperationalError
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import six, timezone
 
-# Create your tests here.
+from drchrono import logs, prefetch, retention, webhooks
+from drchrono.exports import export_lines
+from drchrono.middleware import PRACTICE_SESSION_KEY, get_practice_context
+from drchrono import scheduling
+from drchrono.scheduling import GapTree, SlotIndex
+from drchrono.models import Doctor, Patient, Appointment, ArchivedAppointment, Arrival, WaitTimeStat, WebhookEvent
+from drchrono.views import get_average_wait_time, get_local_appointments_on_date_for_doctor
+
+import csv
+import datetime
+import json
+import logging
+import os
+import random
+
+WEBHOOK_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'webhooks')
+
+
+def replay(*fixtures, **options):
+    output = six.StringIO()
+    call_command('replay_webhook_events', *[os.path.join(WEBHOOK_FIXTURES, name) for name in fixtures],
+                 stdout=output, **options)
+    return output.getvalue()
+
+
+def appointment_event(status, appointment_id=80001, patient_id=70001):
+    return {'object': {'id': appointment_id, 'doctor': 123456, 'patient': patient_id, 'status': status,
+                       'scheduled_time': '2017-12-01T09:00:00', 'duration': 30}}
+
+
+@override_settings(DRCHRONO_WEBHOOK_SECRET='test-secret', DRCHRONO_WEBHOOKS_ENABLED=True)
+class WebhookReplayTest(TestCase):
+
+    def test_replay_sample_day(self):
+        output = replay('sample_day.json')
+
+        self.assertIn('Recorded 6 events (1 duplicates skipped), applied 6', output)
+        self.assertEqual(dict(Patient.objects.values_list('patient_id', 'first_name')),
+                         {70001: 'Ada', 70002: 'Grace'})
+        self.assertEqual(list(Appointment.objects.values_list('appointment_id', 'status')), [('80001', 'Arrived')])
+        self.assertEqual(list(Arrival.objects.values_list('appointment_id', flat=True)), ['80001'])
+        self.assertEqual(WebhookEvent.objects.filter(event_id='sample-0005').count(), 1)
+        self.assertFalse(WebhookEvent.objects.filter(processed=False).exists())
+
+    # appointments that arrive in an earlier batch than their patient hang off a bare record until it is synced
+    def test_replay_one_event_per_batch(self):
+        replay('sample_day.json', batch_size=1)
+
+        self.assertEqual(dict(Patient.objects.values_list('patient_id', 'first_name')),
+                         {70001: 'Ada', 70002: 'Grace'})
+        self.assertFalse(Appointment.objects.filter(appointment_id='80002').exists())
+        self.assertEqual(list(Arrival.objects.values_list('appointment_id', flat=True)), ['80001'])
+
+    def test_replaying_again_records_nothing(self):
+        replay('sample_day.json')
+        output = replay('sample_day.json')
+
+        self.assertIn('Recorded 0 events (7 duplicates skipped), applied 0', output)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_late_event_does_not_move_visit_backwards(self):
+        webhooks.record_event('e1', 'APPOINTMENT_CREATE', appointment_event('In Session'))
+        webhooks.record_event('e2', 'APPOINTMENT_MODIFY', appointment_event('Arrived'))
+        webhooks.apply_pending_events(batch_size=1)
+
+        self.assertEqual(Appointment.objects.get(appointment_id='80001').status, 'In Session')
+        self.assertFalse(Arrival.objects.exists())
+
+    def test_is_behind(self):
+        self.assertTrue(webhooks.is_behind('Arrived', 'In Session'))
+        self.assertTrue(webhooks.is_behind('In Session', 'Complete'))
+        self.assertFalse(webhooks.is_behind('Complete', 'Arrived'))
+        self.assertFalse(webhooks.is_behind('Arrived', 'Arrived'))
+        # statuses set upstream, such as a cancellation, always apply
+        self.assertFalse(webhooks.is_behind('Cancelled', 'In Session'))
+        self.assertFalse(webhooks.is_behind('Arrived', ''))
+
+    def test_malformed_event_is_skipped(self):
+        webhooks.record_event('bad', 'APPOINTMENT_CREATE', {'object': {'id': 80009, 'doctor': 123456, 'patient': None}})
+        webhooks.record_event('good', 'APPOINTMENT_CREATE', appointment_event(''))
+
+        self.assertEqual(webhooks.apply_pending_events(), 1)
+        self.assertTrue(Appointment.objects.filter(appointment_id='80001').exists())
+        bad = WebhookEvent.objects.get(event_id='bad')
+        self.assertTrue(bad.processed and bad.failed)
+        self.assertTrue(bad.payload)
+
+    def test_event_with_bad_data_is_marked_failed(self):
+        bad = appointment_event('', appointment_id=80009)
+        bad['object']['scheduled_time'] = 'not a time'
+        webhooks.record_event('bad', 'APPOINTMENT_CREATE', bad)
+        webhooks.record_event('good', 'APPOINTMENT_CREATE', appointment_event(''))
+
+        self.assertEqual(webhooks.apply_pending_events(), 1)
+        self.assertEqual(list(Appointment.objects.values_list('appointment_id', flat=True)), ['80001'])
+        self.assertTrue(WebhookEvent.objects.get(event_id='bad').failed)
+
+    def test_database_error_leaves_events_pending(self):
+        webhooks.record_event('e1', 'APPOINTMENT_CREATE', appointment_event(''))
+
+        def locked(events):
+            raise OperationalError('database is locked')
+
+        apply_batch, webhooks.apply_batch = webhooks.apply_batch, locked
+        try:
+            with self.assertRaises(OperationalError):
+                webhooks.apply_pending_events()
+        finally:
+            webhooks.apply_batch = apply_batch
+
+        event = WebhookEvent.objects.get(event_id='e1')
+        self.assertFalse(event.processed or event.failed)
+        self.assertEqual(webhooks.apply_pending_events(), 1)
+
+    def test_claimed_batch_is_not_applied_twice(self):
+        webhooks.record_event('e1', 'APPOINTMENT_CREATE', appointment_event(''))
+        events = list(WebhookEvent.objects.all())
+
+        self.assertEqual(webhooks.apply_events(events), 1)
+        self.assertEqual(webhooks.apply_events(events), 0)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+@override_settings(DRCHRONO_WEBHOOK_SECRET='test-secret', DRCHRONO_WEBHOOKS_ENABLED=True)
+class WebhookViewTest(TestCase):
+
+    def post_event(self, event_type, payload, signature=None):
+        body = json.dumps(payload).encode('utf-8')
+        return self.client.post('/webhook/', data=body, content_type='application/json',
+                                HTTP_X_DRCHRONO_EVENT=event_type,
+                                HTTP_X_DRCHRONO_SIGNATURE=signature or webhooks.sign(body))
+
+    def test_valid_signature_is_recorded(self):
+        response = self.post_event('APPOINTMENT_CREATE', appointment_event(''))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.post_event('APPOINTMENT_CREATE', appointment_event(''), signature='0' * 64)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_missing_signature_is_rejected(self):
+        body = json.dumps(appointment_event('')).encode('utf-8')
+        response = self.client.post('/webhook/', data=body, content_type='application/json',
+                                    HTTP_X_DRCHRONO_EVENT='APPOINTMENT_CREATE')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_malformed_payload_is_rejected(self):
+        response = self.post_event('APPOINTMENT_MODIFY', {'object': {'id': 80001, 'doctor': 123456}})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class RetentionTest(TestCase):
+
+    def setUp(self):
+        patient = Patient.objects.create(patient_id=70001, doctor_id=123456)
+        day = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=100)
+        self.old = timezone.make_aware(datetime.datetime.combine(day, datetime.time(9)))
+        for i, minutes in enumerate((10, 20, 30)):
+            Appointment.objects.create(patient=patient, appointment_id=str(80001 + i), doctor_id=123456,
+                                       status='Complete', scheduled_time=self.old + datetime.timedelta(hours=i),
+                                       time_waited=datetime.timedelta(minutes=minutes))
+        Appointment.objects.create(patient=patient, appointment_id='80004', doctor_id=123456, status='In Session',
+                                   scheduled_time=timezone.now(), time_waited=datetime.timedelta(minutes=40))
+        Arrival.objects.create(appointment_id='80001', doctor_id=123456)
+        self.cutoff = timezone.now() - datetime.timedelta(days=90)
+
+    def test_archive_in_batches_keeps_average_wait_time(self):
+        average = get_average_wait_time(123456)
+
+        self.assertEqual(retention.archive_batch(self.cutoff, 2), 2)
+        self.assertEqual(retention.archive_batch(self.cutoff, 2), 1)
+        self.assertEqual(retention.archive_batch(self.cutoff, 2), 0)
+
+        self.assertEqual(list(Appointment.objects.values_list('appointment_id', flat=True)), ['80004'])
+        self.assertEqual(ArchivedAppointment.objects.count(), 3)
+        self.assertFalse(Arrival.objects.exists())
+        stats = WaitTimeStat.objects.values_list('doctor_id', 'date', 'waited_count', 'total_time_waited')
+        self.assertEqual(list(stats), [(123456, self.old.date(), 3, datetime.timedelta(minutes=60))])
+        self.assertEqual(get_average_wait_time(123456), average)
+        self.assertEqual(average, '0:25:00')
+
+
+class AppointmentsOnDateTest(TestCase):
+
+    def test_day_is_half_open_in_local_time(self):
+        patient = Patient.objects.create(patient_id=70001, doctor_id=123456)
+        day = datetime.date(2017, 12, 1)
+        for appointment_id, moment in (('first', datetime.datetime(2017, 12, 1, 0, 0)),
+                                       ('last', datetime.datetime(2017, 12, 1, 23, 59)),
+                                       ('next day', datetime.datetime(2017, 12, 2, 0, 0)),
+                                       ('day before', datetime.datetime(2017, 11, 30, 23, 59))):
+            Appointment.objects.create(patient=patient, appointment_id=appointment_id, doctor_id=123456,
+                                       scheduled_time=timezone.make_aware(moment))
+
+        appointments = get_local_appointments_on_date_for_doctor(123456, timezone.make_aware(
+            datetime.datetime.combine(day, datetime.time(12))))
+
+        self.assertEqual([appointment.appointment_id for appointment in appointments], ['first', 'last'])
+
+
+# the earliest start no earlier than `not_before` whose [start, start + duration) is inside opening hours and clear
+# of every booking; a free slot can only start at `not_before`, opening time or the end of a booking
+def brute_force_first_free_slot(opens, closes, busy, duration, not_before):
+    candidates = [max(not_before, opens)] + [end for _, end in busy if end > not_before]
+    for start in sorted(candidates):
+        if not brute_force_conflicts(opens, closes, busy, start, start + duration):
+            return start
+    return None
+
+
+def brute_force_conflicts(opens, closes, busy, start, end):
+    return start < opens or end > closes or any(s < end and e > start for s, e in busy)
+
+
+class SlotIndexTest(TestCase):
+
+    opens = datetime.datetime(2017, 12, 1, 9, 0)
+    closes = datetime.datetime(2017, 12, 1, 17, 0)
+
+    def minutes(self, minutes):
+        return self.opens + datetime.timedelta(minutes=minutes)
+
+    def random_busy(self, rng):
+        busy = []
+        for _ in range(rng.randint(0, 30)):
+            start = rng.randint(-60, 9 * 60)
+            busy.append((self.minutes(start), self.minutes(start + rng.randint(1, 90))))
+        return busy
+
+    def test_gap_tree_finds_first_long_enough_gap(self):
+        gaps = GapTree([5, 0, 30, 10, 45])
+
+        self.assertEqual(gaps.first_at_least(0, 10), 2)
+        self.assertEqual(gaps.first_at_least(3, 10), 3)
+        self.assertEqual(gaps.first_at_least(0, 40), 4)
+        self.assertIsNone(gaps.first_at_least(0, 50))
+        self.assertIsNone(gaps.first_at_least(5, 1))
+
+    def test_first_free_slot(self):
+        index = SlotIndex(self.opens, self.closes, [(self.minutes(0), self.minutes(30)),
+                                                    (self.minutes(40), self.minutes(90))])
+
+        self.assertEqual(index.first_free_slot(datetime.timedelta(minutes=10)), self.minutes(30))
+        self.assertEqual(index.first_free_slot(datetime.timedelta(minutes=15)), self.minutes(90))
+        self.assertEqual(index.first_free_slot(datetime.timedelta(minutes=10), self.minutes(35)), self.minutes(90))
+        self.assertIsNone(index.first_free_slot(datetime.timedelta(hours=8)))
+
+    def test_add_booking(self):
+        index = SlotIndex(self.opens, self.closes)
+        index.add(self.minutes(0), self.minutes(30))
+
+        self.assertTrue(index.conflicts(self.minutes(15), self.minutes(45)))
+        self.assertFalse(index.conflicts(self.minutes(30), self.minutes(60)))
+        self.assertEqual(index.first_free_slot(datetime.timedelta(minutes=30)), self.minutes(30))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        for _ in range(3000):
+            busy = self.random_busy(rng)
+            index = SlotIndex(self.opens, self.closes, busy)
+            duration = datetime.timedelta(minutes=rng.randint(5, 120))
+            not_before = self.minutes(rng.randint(-60, 9 * 60))
+
+            self.assertEqual(index.first_free_slot(duration, not_before),
+                             brute_force_first_free_slot(self.opens, self.closes, busy, duration, not_before))
+            self.assertEqual(index.conflicts(not_before, not_before + duration),
+                             brute_force_conflicts(self.opens, self.closes, busy, not_before, not_before + duration))
+
+
+class PrefetchTest(TestCase):
+
+    def test_appointments_missing_upstream_are_removed(self):
+        patient = Patient.objects.create(patient_id=70001, doctor_id=123456)
+        day_start = timezone.make_aware(datetime.datetime(2017, 12, 1))
+        for appointment_id, doctor_id, days in (('kept', 123456, 0), ('deleted upstream', 123456, 1),
+                                                ('other doctor', 654321, 0), ('after window', 123456, 8)):
+            Appointment.objects.create(patient=patient, appointment_id=appointment_id, doctor_id=doctor_id,
+                                       scheduled_time=day_start + datetime.timedelta(days=days))
+        Arrival.objects.create(appointment_id='deleted upstream', doctor_id=123456)
+
+        deleted = prefetch.delete_missing_appointments([123456], day_start, day_start + datetime.timedelta(days=8),
+                                                       {'kept'})
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(set(Appointment.objects.values_list('appointment_id', flat=True)),
+                         {'kept', 'other doctor', 'after window'})
+        self.assertFalse(Arrival.objects.exists())
+
+
+class RedactTest(SimpleTestCase):
+
+    def test_unquoted_values_are_masked_up_to_the_next_field(self):
+        self.assertEqual(logs.redact('Patient :: Name: Ada Lovelace, Patient ID: 70001'),
+                         'Patient :: Name: "[REDACTED]", Patient ID: 70001')
+        self.assertEqual(logs.redact('Appointment :: Patient name: Ada Lovelace, Scheduled time: 2017-12-01'),
+                         'Appointment :: Patient name: "[REDACTED]", Scheduled time: 2017-12-01')
+        self.assertEqual(logs.redact('address: 1 Main St'), 'address: "[REDACTED]"')
+        self.assertEqual(logs.redact('first_name=Ada&last_name=Lovelace&doctor=1'),
+                         'first_name="[REDACTED]"&last_name="[REDACTED]"&doctor=1')
+
+    def test_quoted_values_are_masked(self):
+        self.assertEqual(logs.redact('{"first_name": "Mary Ann", "doctor": 1}'),
+                         '{"first_name": "[REDACTED]", "doctor": 1}')
+        self.assertEqual(logs.redact("{'first_name': u'Mary Ann', 'id': 5}"),
+                         "{'first_name': \"[REDACTED]\", 'id': 5}")
+
+    def test_ssns(self):
+        self.assertEqual(logs.redact('ssn 123-45-6789'), 'ssn [REDACTED]')
+        self.assertEqual(logs.redact('ssn 123 45 6789'), 'ssn [REDACTED]')
+        self.assertEqual(logs.redact('ssn 123456789'), 'ssn [REDACTED]')
+        # nine digits that can't be an SSN are left alone
+        self.assertEqual(logs.redact('appointment 900123456'), 'appointment 900123456')
+
+    def test_phone_numbers_and_emails(self):
+        self.assertEqual(logs.redact('call (555) 123-4567, 555.123.4567 or +15551234567'),
+                         'call [REDACTED], [REDACTED] or [REDACTED]')
+        self.assertEqual(logs.redact('write to ada@example.com'), 'write to [REDACTED]')
+        self.assertEqual(logs.redact('appointment 1234567890'), 'appointment 1234567890')
+
+    def test_redact_value(self):
+        self.assertEqual(logs.redact_value({'patient': {'first_name': 'Ada', 'notes': 'ssn 123-45-6789'},
+                                            'doctor': 123456, 1: 'not a key', 'emails': ['ada@example.com']}),
+                         {'patient': {'first_name': '[REDACTED]', 'notes': 'ssn [REDACTED]'},
+                          'doctor': 123456, 1: 'not a key', 'emails': ['[REDACTED]']})
+
+
+class QueueHandlerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.stream = six.StringIO()
+        self.handler = logs.QueueHandler(self.stream)
+        self.handler.addFilter(logs.RedactPHIFilter())
+        self.handler.setFormatter(logs.JsonFormatter())
+        self.logger = logging.getLogger('drchrono.tests.queue_handler')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_records_are_written_as_redacted_json(self):
+        self.logger.warning('Checked in %s', 'Patient :: Name: Ada Lovelace, Patient ID: 70001',
+                            extra={'patient': {'first_name': 'Ada', 'cell_phone': '555-123-4567'},
+                                   'note': 'ssn 123-45-6789'})
+        self.handler.flush()
+
+        entry = json.loads(self.stream.getvalue())
+        self.assertEqual(entry['level'], 'WARNING')
+        self.assertEqual(entry['message'], 'Checked in Patient :: Name: "[REDACTED]", Patient ID: 70001')
+        self.assertEqual(entry['patient'], {'first_name': '[REDACTED]', 'cell_phone': '[REDACTED]'})
+        self.assertEqual(entry['note'], 'ssn [REDACTED]')
+
+    def test_writer_survives_a_failing_record(self):
+        class FailOnBoom(logging.Filter):
+            def filter(self, record):
+                if record.msg == 'boom':
+                    raise ValueError('filter failed')
+                return True
+
+        self.handler.addFilter(FailOnBoom())
+        logging.raiseExceptions, raise_exceptions = False, logging.raiseExceptions
+        try:
+            self.logger.warning('boom')
+            self.logger.warning('still logging')
+            self.handler.flush()
+        finally:
+            logging.raiseExceptions = raise_exceptions
+
+        self.assertNotIn('boom', self.stream.getvalue())
+        self.assertIn('still logging', self.stream.getvalue())
+
+
+class PracticeContextTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('doctor', password='password')
+        self.user.social_auth.create(provider='drchrono', uid='1', extra_data={'access_token': 'token'})
+        self.session = SessionStore()
+
+    def request(self, **cookies):
+        request = RequestFactory().get('/checkin/')
+        request.COOKIES.update(cookies)
+        request.user = self.user
+        request.session = self.session
+        return request
+
+    def test_cached_in_session_after_first_request(self):
+        Doctor.objects.create(user=self.user, doctor_id=123456)
+        practice = get_practice_context(self.request())
+        self.assertEqual((practice.doctor_id, practice.access_token), (123456, 'token'))
+
+        with self.assertNumQueries(0):
+            practice = get_practice_context(self.request())
+        self.assertEqual(practice.doctor_id, 123456)
+        self.assertEqual(practice.auth_header, {'Authorization': 'Bearer token'})
+
+    # until index() has registered the doctor there is nothing worth caching
+    def test_not_cached_before_doctor_is_registered(self):
+        self.assertIsNone(get_practice_context(self.request()).doctor_id)
+        self.assertNotIn(PRACTICE_SESSION_KEY, self.session)
+
+    def test_cleared_on_login(self):
+        Doctor.objects.create(user=self.user, doctor_id=123456)
+        request = self.request()
+        get_practice_context(request)
+        self.assertIn(PRACTICE_SESSION_KEY, self.session)
+
+        user_logged_in.send(sender=User, request=request, user=self.user)
+
+        self.assertNotIn(PRACTICE_SESSION_KEY, self.session)
+
+    def test_timezone_from_cookie(self):
+        self.assertEqual(get_practice_context(self.request(tzname_from_user='Asia/Tokyo')).timezone_name,
+                         'Asia/Tokyo')
+        self.assertEqual(get_practice_context(self.request(tzname_from_user='Not/AZone')).timezone_name, 'UTC')
+        self.assertEqual(get_practice_context(self.request()).timezone_name, 'UTC')
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.zoe = Patient.objects.create(patient_id=70001, doctor_id=123456, first_name=u'Zoë', last_name='Example')
+        other = Patient.objects.create(patient_id=70002, doctor_id=654321, first_name='Other', last_name='Doctor')
+        for appointment_id, patient, moment in (('before', self.zoe, datetime.datetime(2017, 11, 30, 23, 59)),
+                                                ('first', self.zoe, datetime.datetime(2017, 12, 1, 0, 0)),
+                                                ('last', self.zoe, datetime.datetime(2017, 12, 31, 23, 59)),
+                                                ('after', self.zoe, datetime.datetime(2018, 1, 1, 0, 0)),
+                                                ('other doctor', other, datetime.datetime(2017, 12, 15, 9, 0))):
+            Appointment.objects.create(patient=patient, appointment_id=appointment_id, doctor_id=patient.doctor_id,
+                                       scheduled_time=timezone.make_aware(moment), status='Complete')
+        ArchivedAppointment.objects.create(appointment_id='archived', patient_id=70001, doctor_id=123456,
+                                           scheduled_time=timezone.make_aware(datetime.datetime(2017, 12, 2, 9, 0)),
+                                           time_waited=datetime.timedelta(minutes=5), status='Complete')
+
+    def export(self, *args):
+        return [json.loads(line) for line in export_lines('appointments', 'jsonl', 123456, *args)]
+
+    def test_scoped_to_doctor(self):
+        rows = self.export()
+
+        self.assertEqual([row['appointment_id'] for row in rows], ['before', 'first', 'last', 'after', 'archived'])
+        self.assertEqual(set(row['doctor_id'] for row in rows), {123456})
+
+    def test_date_range_is_inclusive(self):
+        rows = self.export(datetime.date(2017, 12, 1), datetime.date(2017, 12, 31))
+
+        self.assertEqual([row['appointment_id'] for row in rows], ['first', 'last', 'archived'])
+
+    def test_archived_rows_have_patient_names(self):
+        archived = [row for row in self.export() if row['appointment_id'] == 'archived'][0]
+
+        self.assertEqual((archived['patient_first_name'], archived['patient_last_name']), (u'Zoë', 'Example'))
+        self.assertEqual(archived['time_waited_seconds'], 300)
+
+    def test_csv_with_non_ascii_names(self):
+        lines = list(export_lines('patients', 'csv', 123456))
+
+        self.assertTrue(all(isinstance(line, six.text_type) for line in lines))
+        self.assertEqual(lines[1], u'70001,123456,Zoë,Example,O,\r\n')
+
+
+class ExportViewTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('doctor', password='password')
+        user.social_auth.create(provider='drchrono', uid='1', extra_data={'access_token': 'token'})
+        Doctor.objects.create(user=user, doctor_id=123456)
+        self.client.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+        patient = Patient.objects.create(patient_id=70001, doctor_id=123456, first_name='Ada', last_name='Example')
+        Appointment.objects.create(patient=patient, appointment_id='80001', doctor_id=123456, status='Complete',
+                                   scheduled_time=timezone.make_aware(datetime.datetime(2017, 12, 1, 9, 0)))
+
+    def test_streams_csv(self):
+        response = self.client.get('/export/', {'resource': 'appointments', 'format': 'csv',
+                                                'start': '2017-12-01', 'end': '2017-12-01'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0][0], 'appointment_id')
+        self.assertEqual([row[0] for row in rows[1:]], ['80001'])
+
+    def test_bad_date(self):
+        response = self.client.get('/export/', {'start': 'not a date'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_format(self):
+        response = self.client.get('/export/', {'format': 'xml'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class OfficeTimeTest(SimpleTestCase):
+
+    # walk-in slots are found in the office's timezone, not whichever one is active for the request
+    def test_office_time_ignores_active_timezone(self):
+        with timezone.override('Asia/Tokyo'):
+            now = scheduling.office_now()
+            opens, closes = scheduling.office_hours_on({'start_time': '09:00:00', 'end_time': '17:00:00'}, now.date())
+
+        self.assertEqual(now.tzinfo.zone, settings.TIME_ZONE)
+        self.assertEqual(timezone.localtime(opens, timezone.get_default_timezone()).hour, 9)
+        self.assertEqual(timezone.localtime(closes, timezone.get_default_timezone()).hour, 17)
+
+    def test_next_slot_boundary(self):
+        with self.settings(SLOT_GRANULARITY_MINUTES=5):
+            self.assertEqual(scheduling.next_slot_boundary(datetime.datetime(2017, 12, 1, 10, 32, 17)),
+                             datetime.datetime(2017, 12, 1, 10, 35))
+            self.assertEqual(scheduling.next_slot_boundary(datetime.datetime(2017, 12, 1, 10, 35)),
+                             datetime.datetime(2017, 12, 1, 10, 35))
@@ -15,5 +15,9 @@ urlpatterns = [
     url(r'^demographics/', views.update_demographics, name='demographics'),
     url(r'^call_in_patient/', views.call_in_patient, name='call_in_patient'),
     url(r'^appointment_completed/', views.appointment_completed, name='appointment_completed'),
-    url(r'^poll_for_updates/', views.poll_for_updates, name='poll_for_updates')
+    url(r'^poll_for_updates/', views.poll_for_updates, name='poll_for_updates'),
+    url(r'^export/', views.export_history, name='export_history'),
+    url(r'^webhook/', views.webhook, name='webhook'),
+    url(r'^profiles/$', views.list_profiles, name='list_profiles'),
+    url(r'^profiles/(?P<name>[\w.-]+)$', views.download_profile, name='download_profile')
 ]
@@ -1,24 +1,31 @@
 from django.contrib.auth import logout as user_logout
 from django.shortcuts import redirect, render
-from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse
-from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, \
+    HttpResponseNotFound, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Q
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from drchrono.exports import EXPORT_FORMATS, EXPORT_RESOURCES, export_lines
 from drchrono.forms import CheckinForm, DemographicsForm, WalkinForm
+from drchrono.logs import log_upstream
+from drchrono.middleware import set_practice_doctor_id
+from drchrono import prefetch, profiling, scheduling, webhooks
+from drchrono.api import api_url
 from dateutil import parser as date_parser
 
-from drchrono.models import Doctor, Patient, Appointment, Arrival
+from drchrono.models import Doctor, Patient, Appointment, Arrival, WaitTimeStat
 
 import json
+import os
 import requests
 import datetime
-import pytz
 import logging
 
 log = logging.getLogger(__name__)
 
-logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s.%(funcName)s %(message)s', level=logging.INFO)
-
 
 def login_page(request):
     if request.user.is_authenticated():
@@ -37,20 +44,19 @@ def index(request):
     curr_date = get_local_datetime(request)
     auth_header = get_auth_header(request)
     # if doctor_id not in DB, create entry
-    try:
-        doctor = Doctor.objects.get(user=request.user)
-        log.info("Found doctor")
-    except ObjectDoesNotExist:
-        log.info("Calling API")
-        doctor = Doctor(user=request.user)
-        doctor.doctor_id = get_doctor_id(auth_header)
-        doctor.save()
-
-    # updated patient objects to DB
-    _ = get_all_patients(auth_header)
-    curr_appointments = get_appointments_on_date_for_doctor(doctor.doctor_id, curr_date, auth_header)
+    doctor_id = request.practice.doctor_id
+    if doctor_id is None:
+        log.info("Doctor not found locally; calling API")
+        doctor, _ = Doctor.objects.get_or_create(user=request.user, defaults={'doctor_id': get_doctor_id(auth_header)})
+        doctor_id = doctor.doctor_id
+        set_practice_doctor_id(request, doctor_id)
+
+    # the practice's schedule for the next few days is prefetched into the database and refreshed once it goes stale
+    if not prefetch.is_window_warm(doctor_id, curr_date.date()):
+        prefetch.prefetch_window(doctor_id, auth_header, curr_date.date())
+    curr_appointments = get_local_appointments_on_date_for_doctor(doctor_id, curr_date)
     content = {}
-    average_wait_time = get_average_wait_time(doctor.doctor_id)
+    average_wait_time = get_average_wait_time(doctor_id)
     if average_wait_time:
         content['average_wait_time'] = average_wait_time
 
@@ -60,71 +66,43 @@ def index(request):
 
 # work in doctor timezone
 def get_local_datetime(request):
-    user_timezone = request.COOKIES.get('tzname_from_user', 'UTC')
-    return datetime.datetime.now(pytz.timezone(user_timezone))
+    return request.practice.now()
 
 
 def get_auth_header(request):
-    access_token = request.user.social_auth.get(provider='drchrono').extra_data['access_token']
-    headers = {
-        'Authorization': 'Bearer ' + access_token
-    }
-    return headers
+    return request.practice.auth_header
 
 
 def get_doctor_id(auth_header):
-    users_url = 'https://drchrono.com/api/users/current'
+    users_url = api_url('/users/current')
     resp = requests.get(users_url, headers=auth_header)
     resp.raise_for_status()
     return resp.json()['doctor']
 
 
-# fetch all appointments for doctor from API, and persist them to database
-def get_appointments_on_date_for_doctor(doctor_id, curr_date, auth_header):
-
-    appointments = []
-    appointments_url = 'https://drchrono.com/api/appointments?doctor=' + str(doctor_id) + '&date=' + str(curr_date)
-    while appointments_url:
-
-        resp = requests.get(appointments_url, headers=auth_header)
-        resp.raise_for_status()
-        data = resp.json()
-
-        # If retrieved appointment isn't in the database, create an appointment record
-        for appointment in data['results']:
-
-            appointment_obj, created_now = Appointment.objects.get_or_create(
-                appointment_id=appointment['id'],
-                patient=Patient.objects.get(patient_id=appointment['patient']),
-                doctor_id=appointment['doctor']
-            )
-            if created_now:
-                appointment_obj.time_waited = None
-
-            appointment_obj.status = appointment['status']
-            appointment_obj.scheduled_time = appointment['scheduled_time']
-            appointment_obj.save()
-            appointment_obj.scheduled_time = date_parser.parse(appointment['scheduled_time'])
-
-            appointments.append(appointment_obj)
-
-        # last page returns a null for appointments_url
-        appointments_url = data['next']
-    return appointments
+# fetch the doctor's appointments on a date from the database, as kept current by prefetching and webhooks
+def get_local_appointments_on_date_for_doctor(doctor_id, curr_date):
+    day_start, day_end = scheduling.day_bounds(curr_date.date())
+    return list(Appointment.objects.filter(doctor_id=doctor_id, scheduled_time__gte=day_start,
+                                           scheduled_time__lt=day_end)
+                .select_related('patient').order_by('scheduled_time'))
 
 
-# fetch completed or ongoing appointments from database; get average of time waited (floor)
+# average time waited (floor) over the doctor's completed or ongoing appointments, including archived ones
 def get_average_wait_time(doctor_id):
 
     completed_appointments = Appointment.objects.filter(
-        (Q(status='Complete') | Q(status='In Session')) & Q(doctor_id=doctor_id)
+        (Q(status='Complete') | Q(status='In Session')) & Q(doctor_id=doctor_id) & Q(time_waited__isnull=False)
     )
-    if not completed_appointments:
-        return None
+    waited = list(completed_appointments.values_list('time_waited', flat=True))
+    archived = list(WaitTimeStat.objects.filter(doctor_id=doctor_id).values_list('waited_count', 'total_time_waited'))
 
-    completed_appointments = [appointment.time_waited for appointment in completed_appointments]
+    count = len(waited) + sum(waited_count for waited_count, _ in archived)
+    if not count:
+        return None
 
-    avg = sum(completed_appointments, datetime.timedelta()) / len(completed_appointments)
+    total = sum(waited, datetime.timedelta()) + sum((total for _, total in archived), datetime.timedelta())
+    avg = total / count
     avg = str(avg).split('.')[0]  # remove fractions smaller than a second from timedelta object
 
     return avg
@@ -132,8 +110,8 @@ def get_average_wait_time(doctor_id):
 
 # get specific patient by matching entered form data from API call; return first match if found else None
 def get_patient_info(first_name, last_name, doctor_id, social_security_number, auth_header):
-    patients_url = 'https://drchrono.com/api/patients?doctor=' + str(doctor_id) + \
-                   '&first_name=' + first_name + '&last_name=' + last_name
+    patients_url = api_url('/patients?doctor=' + str(doctor_id) +
+                           '&first_name=' + first_name + '&last_name=' + last_name)
     while patients_url:
         resp = requests.get(patients_url, headers=auth_header)
         resp.raise_for_status()
@@ -151,34 +129,17 @@ def get_patient_info(first_name, last_name, doctor_id, social_security_number, a
     return None
 
 
-# fetch all patients of doctor from API, and persist them to database
-def get_all_patients(auth_header):
-    patients = []
-    patients_url = 'https://drchrono.com/api/patients'
-    while patients_url:
-        resp = requests.get(patients_url, headers=auth_header)
-        resp.raise_for_status()
-
-        for patient in resp.json()['results']:
-            # If retrieved patient isn't in the database, create an patient record
-            patient_obj, created = Patient.objects.get_or_create(patient_id=patient['id'], doctor_id=patient['doctor'])
-            if created:
-                patient_obj.gender = patient['gender']
-                patient_obj.first_name = patient['first_name']
-                patient_obj.last_name = patient['last_name']
-                patient_obj.email = patient['email']
-                patient_obj.save()
-            patients.append(patient_obj)
-
-        patients_url = resp.json()['next']  # A JSON null on the last page
-
-    return patients
-
-
-# look up scheduled appointments on current date for patient ID from API
+# look up scheduled appointments on current date for patient ID, from the prefetched schedule or else the API
 def get_appointment_on_date_for_patient(patient_id, curr_date, auth_header):
 
-    appointments_url = "https://drchrono.com/api/appointments?date=" + str(curr_date) + "&patient=" + str(patient_id)
+    day_start, day_end = scheduling.day_bounds(curr_date.date())
+    appointment_id = Appointment.objects.filter(patient__patient_id=patient_id, scheduled_time__gte=day_start,
+                                                scheduled_time__lt=day_end) \
+        .exclude(status__in=scheduling.FREED_STATUSES).values_list('appointment_id', flat=True).first()
+    if appointment_id:
+        return {'id': appointment_id}
+
+    appointments_url = api_url("/appointments?date=" + str(curr_date) + "&patient=" + str(patient_id))
 
     resp = requests.get(appointments_url, headers=auth_header)
     resp.raise_for_status()
@@ -187,6 +148,23 @@ def get_appointment_on_date_for_patient(patient_id, curr_date, auth_header):
     return results[0] if results else None  # either return the first appointment found or the patient has none
 
 
+# Initial data from API; update demographics form pre-fill
+def get_demographics_form(patient_info, patient_appointment):
+    initial_data = {
+        'patient_id': patient_info['id'],
+        'appointment_id': patient_appointment['id'],
+        'cell_phone': patient_info.get('cell_phone'),
+        'email': patient_info.get('email'),
+        'zip_code': patient_info.get('zip_code'),
+        'address': patient_info.get('address'),
+        'emergency_contact_phone': patient_info.get('emergency_contact_phone'),
+        'emergency_contact_name': patient_info.get('emergency_contact_name')
+    }
+
+    initial_data['initial_form_data'] = json.dumps(initial_data, ensure_ascii=False)
+    return DemographicsForm(initial=initial_data)
+
+
 @login_required(login_url=login_page)
 def register_walkin_patient(request):
 
@@ -200,7 +178,7 @@ def register_walkin_patient(request):
             last_name = walkin_form.cleaned_data['last_name'].strip()
             social_security_number = walkin_form.cleaned_data['social_security_number'].strip()
             gender = walkin_form.cleaned_data['gender'].strip()
-            doctor_id = Doctor.objects.get(user=request.user).doctor_id
+            doctor_id = request.practice.doctor_id
 
             curr_date = get_local_datetime(request)
             auth_header = get_auth_header(request)
@@ -209,33 +187,24 @@ def register_walkin_patient(request):
             if patient_info:
                 # get patient info from API
                 patient_appointment = get_appointment_on_date_for_patient(patient_info['id'], curr_date, auth_header)
+            else:  # no patient found with given name and/or SSN
+                patient_info = create_patient(request, doctor_id, first_name, last_name, social_security_number, gender)
+                patient_appointment = None
+
+            if not patient_appointment:
+                # no appointments today for patient; book them into the first free slot
+                try:
+                    patient_appointment = create_appointment(request, doctor_id, patient_info['id'])
+                except requests.HTTPError:
+                    walkin_form.add_error('first_name', 'Sorry, we are unable to book an appointment '
+                                                        'right now - please try again')
+                    return render(request, 'kiosk-walkin.html', {'walkin_form': walkin_form})
+
+            if patient_appointment:
+                demographics_form = get_demographics_form(patient_info, patient_appointment)
+                return render(request, 'update-demographics.html', {'demographics_form': demographics_form})
 
-                if patient_appointment:
-                    # Initial data from API; if found, update demographics form pre-fill
-                    initial_data = {
-                        'patient_id': patient_info['id'],
-                        'appointment_id': patient_appointment['id'],
-                        'cell_phone': patient_info['cell_phone'],
-                        'email': patient_info['email'],
-                        'zip_code': patient_info['zip_code'],
-                        'address': patient_info['address'],
-                        'emergency_contact_phone': patient_info['emergency_contact_phone'],
-                        'emergency_contact_name': patient_info['emergency_contact_name']
-                    }
-
-                    initial_data['initial_form_data'] = json.dumps(initial_data, ensure_ascii=False)
-                    demographics_form = DemographicsForm(initial=initial_data)
-
-                    return render(request, 'update-demographics.html', {'demographics_form': demographics_form})
-
-                else:
-                    # no appointments today for patient
-                    walkin_form.add_error('first_name', 'You have no appointments scheduled for today')
-                    # TODO: add appointment creation for walk-in patient
-
-            else:  # no appointments found for patient with given name and/or SSN
-                create_patient(request, doctor_id, first_name, last_name, social_security_number, gender)
-                # TODO: add appointment creation for walk-in patient
+            walkin_form.add_error('first_name', 'Sorry, there are no appointments left today')
 
         return render(request, 'kiosk-walkin.html', {'walkin_form': walkin_form})
 
@@ -256,7 +225,7 @@ def checkin_patient(request):
             first_name = checkin_form.cleaned_data['first_name'].strip()
             last_name = checkin_form.cleaned_data['last_name'].strip()
             social_security_number = checkin_form.cleaned_data['social_security_number'].strip()
-            doctor_id = Doctor.objects.get(user=request.user).doctor_id
+            doctor_id = request.practice.doctor_id
 
             curr_date = get_local_datetime(request)
             auth_header = get_auth_header(request)
@@ -267,21 +236,7 @@ def checkin_patient(request):
                 patient_appointment = get_appointment_on_date_for_patient(patient_info['id'], curr_date, auth_header)
 
                 if patient_appointment:
-                    # Initial data from API; if found, update demographics form pre-fill
-                    initial_data = {
-                        'patient_id': patient_info['id'],
-                        'appointment_id': patient_appointment['id'],
-                        'cell_phone': patient_info['cell_phone'],
-                        'email': patient_info['email'],
-                        'zip_code': patient_info['zip_code'],
-                        'address': patient_info['address'],
-                        'emergency_contact_phone': patient_info['emergency_contact_phone'],
-                        'emergency_contact_name': patient_info['emergency_contact_name']
-                    }
-
-                    initial_data['initial_form_data'] = json.dumps(initial_data, ensure_ascii=False)
-                    demographics_form = DemographicsForm(initial=initial_data)
-
+                    demographics_form = get_demographics_form(patient_info, patient_appointment)
                     return render(request, 'update-demographics.html', {'demographics_form': demographics_form})
 
                 else:
@@ -320,7 +275,7 @@ def update_demographics(request):
                 demographics_form.changed_data.remove('initial_form_data')
 
             if demographics_form.has_changed():
-                log.info("The following fields changed: %s" % ", ".join(demographics_form.changed_data))
+                log.info("The following fields changed: %s", ", ".join(demographics_form.changed_data))
 
                 updated = submit_update(demographics_form, auth_header)
                 # if updating the demographics via API fails
@@ -344,7 +299,7 @@ def update_demographics(request):
             appointment_obj.status = "Arrived"
             appointment_obj.arrival_time = get_local_datetime(request)
             appointment_obj.save()
-            log.info("New arrival time: %s" % str(appointment_obj.arrival_time))
+            log.info("New arrival time: %s", appointment_obj.arrival_time)
 
             content = {'patient_queue': patient_queue}
 
@@ -367,12 +322,11 @@ def submit_update(demographics_form, auth_header):
     for field in changed_fields:
         data[field] = demographics_form.cleaned_data[field]
 
-    url = 'https://drchrono.com/api/patients/' + str(demographics_form.cleaned_data['patient_id'])
+    url = api_url('/patients/' + str(demographics_form.cleaned_data['patient_id']))
 
     r = requests.patch(url, data=data, headers=auth_header)
     r.raise_for_status()
-    logging.info("REQ: Update patient demographic details :: REQ_DETAILS: %s :: RESP:-> Status code: %d, TEXT: %s" %
-                 (r.request, r.status_code, r.text))
+    log_upstream(log, "Update patient demographic details", r)
 
     if r.status_code == 204:  # TODO: Check if r.ok includes 204
         return True
@@ -383,12 +337,11 @@ def submit_update(demographics_form, auth_header):
 # send updated appointment information upstream
 def change_appointment_status(appointment_id, auth_header, status):
     data = {'status': status}
-    url = "https://drchrono.com/api/appointments/" + str(appointment_id)
+    url = api_url("/appointments/" + str(appointment_id))
 
     r = requests.patch(url, data=data, headers=auth_header)
     r.raise_for_status()
-    logging.info("REQ: Change appointment status :: REQ_DETAILS: %s :: RESP:-> Status code: %d, TEXT: %s" %
-                 (r.request, r.status_code, r.text))
+    log_upstream(log, "Change appointment status", r)
 
     if r.status_code == 204:  # Successful patch returns a 204
         return True
@@ -408,11 +361,12 @@ def poll_for_updates(request):
     if request.method == 'POST':
         try:
             log.debug('polling...')
-            doctor_id = Doctor.objects.get(user=request.user).doctor_id
-            updates = Arrival.objects.filter(doctor_id=doctor_id)
-            updates = map(lambda x: x.appointment_id, updates)
+            if settings.DRCHRONO_WEBHOOKS_ENABLED:
+                apply_webhook_events(webhooks.apply_pending_events)  # surface arrivals still waiting in a batch
+            doctor_id = request.practice.doctor_id
+            updates = list(Arrival.objects.filter(doctor_id=doctor_id).values_list('appointment_id', flat=True))
 
-            Arrival.objects.all().delete()
+            Arrival.objects.filter(doctor_id=doctor_id, appointment_id__in=updates).delete()
             return JsonResponse({'status': 'success', 'updates': updates})
         except:
             return JsonResponse({'status': 'fail', 'message': 'Failed to poll'})
@@ -461,9 +415,10 @@ def appointment_completed(request):
         return HttpResponse('ok')
 
 
+# register a new patient upstream and locally; returns the patient from the API
 def create_patient(request, doctor_id, first_name, last_name, social_security_number, gender):
 
-    patients_url = 'https://drchrono.com/api/patients'
+    patients_url = api_url('/patients')
     auth_header = get_auth_header(request)
     auth_header['Content-Type'] = "application/json"
     payload = {
@@ -483,19 +438,154 @@ def create_patient(request, doctor_id, first_name, last_name, social_security_nu
         patient_obj.last_name = last_name
         patient_obj.save()
 
-    return True
+    return resp.json()
+
+
+# fetch the doctor's office (opening hours and exam rooms) from the API, cached since it rarely changes
+def get_office_for_doctor(doctor_id, auth_header):
+    cache_key = 'office:%s' % doctor_id
+    office = cache.get(cache_key)
+    if office is None:
+        resp = requests.get(api_url('/offices?doctor=' + str(doctor_id)), headers=auth_header)
+        resp.raise_for_status()
+        results = resp.json()['results']
+        office = results[0] if results else {}
+        cache.set(cache_key, office, settings.OFFICE_CACHE_SECONDS)
+    return office
 
 
-# TODO: Complete this by fetching office information and a way to check overlaps
-def create_appointment(request, doctor_id, first_name, last_name, social_security_number, gender):
+# book an appointment today at `start`, or the first free slot if not given, checking for overlaps locally
+# before posting upstream. Returns the appointment from the API, or None if there is no room for it; raises
+# requests.HTTPError if the API refuses the booking
+def create_appointment(request, doctor_id, patient_id, start=None):
 
-    appointments_url = 'https://drchrono.com/api/appointments'
+    duration = datetime.timedelta(minutes=settings.WALKIN_DURATION)
+    curr_date = scheduling.office_now()
     auth_header = get_auth_header(request)
-    auth_header['Content-Type'] = "application/json"
-    payload = {}
+    office = get_office_for_doctor(doctor_id, auth_header)
+    exam_rooms = office.get('exam_rooms') or [{'index': 1}]
+
+    with scheduling.slot_indexes.doctor_lock(doctor_id):
+        slot_index = scheduling.slot_indexes.get(doctor_id, curr_date.date(), office)
+        if start is None:
+            start = slot_index.first_free_slot(duration, scheduling.next_slot_boundary(curr_date))
+        if start is None or slot_index.conflicts(start, start + duration):
+            return None
+
+        auth_header['Content-Type'] = "application/json"
+        payload = {
+            'doctor': int(doctor_id),
+            'patient': int(patient_id),
+            'office': office.get('id'),
+            'exam_room': exam_rooms[0]['index'],
+            'duration': settings.WALKIN_DURATION,
+            'scheduled_time': timezone.localtime(start, timezone.get_default_timezone()).strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        resp = requests.post(api_url('/appointments'), json=payload, headers=auth_header)
+        log_upstream(log, "Create appointment", resp)
+        if not resp.ok:
+            # upstream may know of a booking we don't; reload the day so the slot isn't offered again
+            try:
+                prefetch.refresh_day(doctor_id, auth_header, curr_date.date())
+            finally:
+                scheduling.slot_indexes.invalidate(doctor_id, curr_date.date())
+            resp.raise_for_status()
+        slot_index.add(start, start + duration)
+
+    appointment = resp.json()
+    patient_obj, _ = Patient.objects.get_or_create(patient_id=patient_id, defaults={'doctor_id': doctor_id})
+    Appointment.objects.get_or_create(appointment_id=str(appointment['id']), defaults={
+        'patient': patient_obj,
+        'doctor_id': doctor_id,
+        'scheduled_time': start,
+        'duration': settings.WALKIN_DURATION
+    })
+    return appointment
+
+
+# stream the logged-in doctor's appointment or patient history as CSV or JSON Lines, e.g.
+# /export/?resource=appointments&format=csv&start=2017-01-01&end=2017-12-31
+@login_required(login_url=login_page)
+def export_history(request):
+
+    resource = request.GET.get('resource', 'appointments')
+    export_format = request.GET.get('format', 'csv')
+    if resource not in EXPORT_RESOURCES or export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('resource must be one of %s and format one of %s' %
+                                      (', '.join(EXPORT_RESOURCES), ', '.join(EXPORT_FORMATS)))
+    try:
+        start_date = date_parser.parse(request.GET['start']).date() if request.GET.get('start') else None
+        end_date = date_parser.parse(request.GET['end']).date() if request.GET.get('end') else None
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest('start and end must be dates, e.g. 2017-12-31')
 
-    resp = requests.post(appointments_url,  json=payload, headers=auth_header)
+    lines = export_lines(resource, export_format, request.practice.doctor_id, start_date, end_date)
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (resource, export_format)
+    return response
+
+
+# receives drchrono change notifications: GET answers the verification handshake, POST delivers an event.
+# Events are stored (ignoring redeliveries) and applied to the local tables in batches
+@csrf_exempt
+def webhook(request):
+
+    if not settings.DRCHRONO_WEBHOOKS_ENABLED:
+        return HttpResponseNotFound()
+
+    if request.method == 'GET':
+        if 'msg' not in request.GET:
+            return HttpResponseBadRequest('msg is required')
+        return JsonResponse({'secret_token': webhooks.verification_token(request.GET['msg'])})
+
+    if request.method == 'POST':
+        if not webhooks.is_signature_valid(request.body, request.META.get('HTTP_X_DRCHRONO_SIGNATURE')):
+            return HttpResponseForbidden('invalid signature')
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return HttpResponseBadRequest('body must be JSON')
+
+        event_type = request.META.get('HTTP_X_DRCHRONO_EVENT', '')
+        if not webhooks.is_valid_payload(event_type, payload):
+            return HttpResponseBadRequest('payload is missing object fields required for %s' % event_type)
+        event_id = webhooks.get_event_id(event_type, request.body, request.META.get('HTTP_X_DRCHRONO_DELIVERY'))
+        created = webhooks.record_event(event_id, event_type, payload)
+        apply_webhook_events(webhooks.apply_if_due)
+
+        return JsonResponse({'status': 'success', 'duplicate': not created})
+
+    return HttpResponseBadRequest()
+
+
+# events stay stored when applying them fails, to be retried on the next delivery or poll
+def apply_webhook_events(apply):
+    try:
+        apply()
+    except Exception:
+        log.exception("Applying webhook events failed")
+
+
+# the admin site isn't installed, so staff-only views send everyone else to this app's login page
+staff_required = user_passes_test(lambda user: user.is_active and user.is_staff, login_url=login_page)
+
+
+# lists recent request profiles captured by ProfilingMiddleware
+@staff_required
+def list_profiles(request):
+    return render(request, 'profiles.html', {'profiles': profiling.list_profiles(),
+                                             'enabled': settings.PROFILING_ENABLED,
+                                             'sample_rate': settings.PROFILE_SAMPLE_RATE})
 
-    resp.raise_for_status()
 
-    return True
+@staff_required
+def download_profile(request, name):
+    if not profiling.PROFILE_NAME_RE.match(name):
+        raise Http404
+    path = os.path.join(settings.PROFILE_DIR, name)
+    if not os.path.isfile(path):
+        raise Http404
+    response = FileResponse(open(path, 'rb'), content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % name
+    return response
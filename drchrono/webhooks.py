@@ -0,0 +1,227 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import six, timezone
+
+from drchrono.models import Patient, Appointment, Arrival, WebhookEvent
+
+from collections import OrderedDict
+
+import hashlib
+import hmac
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# what applying an event raises when its data is bad; database errors (e.g. a locked database) are retried instead
+DATA_ERRORS = (KeyError, TypeError, ValueError, ValidationError)
+
+# drchrono event types this app applies; anything else is acknowledged and ignored
+EVENT_TYPES = (
+    'APPOINTMENT_CREATE', 'APPOINTMENT_MODIFY', 'APPOINTMENT_DELETE',
+    'PATIENT_CREATE', 'PATIENT_MODIFY', 'PATIENT_DELETE',
+)
+
+# statuses this app sets itself, in the order a visit goes through them. The app's own status changes come back
+# as events, possibly after the dashboard has moved on, so an event never moves an appointment backwards in this list
+VISIT_PROGRESS = ('Arrived', 'In Session', 'Complete')
+
+
+def sign(message):
+    return hmac.new(settings.DRCHRONO_WEBHOOK_SECRET.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+# answer drchrono's verification handshake, which echoes the HMAC of `msg` back as the secret token
+def verification_token(msg):
+    return sign(msg.encode('utf-8'))
+
+
+# deliveries carry an HMAC-SHA256 of the raw body, keyed with the webhook secret
+def is_signature_valid(body, signature):
+    return bool(signature) and hmac.compare_digest(sign(body), str(signature))
+
+
+# deliveries are identified by the delivery header; replays without one fall back to a hash of the content
+def get_event_id(event_type, body, delivery_id=None):
+    return delivery_id or hashlib.sha256(event_type.encode('utf-8') + b':' + body).hexdigest()
+
+
+# whether a delivery has the fields applying it relies on; event types this app ignores are accepted as they are
+def is_valid_payload(event_type, payload):
+    if event_type not in EVENT_TYPES:
+        return True
+    obj = payload.get('object') if isinstance(payload, dict) else None
+    if not isinstance(obj, dict) or obj.get('id') in (None, ''):
+        return False
+    if event_type.endswith('_DELETE'):
+        return True
+    required = ('doctor', 'patient') if event_type.startswith('APPOINTMENT') else ('doctor',)
+    return all(isinstance(obj.get(field), six.integer_types) for field in required)
+
+
+# store an incoming event unless it has been seen before; returns whether it was new
+def record_event(event_id, event_type, payload):
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(event_id=event_id, event_type=event_type, payload=json.dumps(payload))
+    except IntegrityError:
+        log.info("Ignoring duplicate webhook event %s", event_id)
+        return False
+    return True
+
+
+# apply pending events once enough have queued up or the oldest has waited long enough
+def apply_if_due():
+    pending = WebhookEvent.objects.filter(processed=False)
+    oldest = pending.order_by('pk').values_list('received_at', flat=True).first()
+    if oldest is None:
+        return 0
+    too_old = timezone.now() - oldest >= settings.WEBHOOK_BATCH_MAX_DELAY
+    if too_old or pending.count() >= settings.WEBHOOK_BATCH_SIZE:
+        return apply_pending_events()
+    return 0
+
+
+# drain unprocessed events in batches, each applied in one transaction; returns how many were applied.
+# A batch with bad data is retried one event at a time, so a bad event is marked failed instead of holding up the
+# rest. Database errors are raised with the events left pending, to be retried on the next delivery or poll
+def apply_pending_events(batch_size=None):
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    applied = 0
+    while True:
+        events = list(WebhookEvent.objects.filter(processed=False).order_by('pk')[:batch_size])
+        if not events:
+            return applied
+        try:
+            applied += apply_events(events)
+        except DatabaseError:
+            raise
+        except DATA_ERRORS:
+            log.exception("Failed to apply %d webhook events together; applying them one at a time", len(events))
+            for event in events:
+                try:
+                    applied += apply_events([event])
+                except DATA_ERRORS:
+                    log.exception("Failed to apply webhook event %s (%s)", event.event_id, event.event_type)
+                    WebhookEvent.objects.filter(pk=event.pk, processed=False).update(processed=True, failed=True)
+
+
+# claim the events and apply them in one transaction; returns how many were applied. The claim is a conditional
+# update, so when a webhook delivery and a dashboard poll pick up the same batch only one of them applies it
+def apply_events(events):
+    with transaction.atomic():
+        pks = [event.pk for event in events]
+        if WebhookEvent.objects.filter(pk__in=pks, processed=False).update(processed=True) != len(events):
+            transaction.set_rollback(True)  # some were applied elsewhere; the caller picks up whatever is left
+            return 0
+        failed = apply_batch(events)
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in failed]).update(failed=True)
+        WebhookEvent.objects.filter(pk__in=pks, failed=False).update(payload='')
+    if failed:
+        log.warning("Skipped %d malformed webhook events", len(failed))
+    log.info("Applied %d webhook events", len(events) - len(failed))
+    return len(events) - len(failed)
+
+
+# collapse a batch to the last change per object, then apply patients before the appointments that refer to them.
+# Returns the events that were skipped as malformed
+def apply_batch(events):
+    changes = {'PATIENT': OrderedDict(), 'APPOINTMENT': OrderedDict()}
+    failed = []
+    for event in events:
+        if event.event_type not in EVENT_TYPES:
+            continue
+        try:
+            payload = json.loads(event.payload)
+        except ValueError:
+            payload = None
+        if not is_valid_payload(event.event_type, payload):
+            log.warning("Skipping malformed webhook event %s (%s)", event.event_id, event.event_type)
+            failed.append(event)
+            continue
+        kind, action = event.event_type.split('_', 1)
+        obj = payload['object']
+        changes[kind][str(obj['id'])] = (action == 'DELETE', obj)
+
+    apply_patient_changes(changes['PATIENT'])
+    apply_appointment_changes(changes['APPOINTMENT'])
+    return failed
+
+
+def apply_patient_changes(changes):
+    deleted = [int(patient_id) for patient_id, (is_delete, _) in changes.items() if is_delete]
+    if deleted:
+        Patient.objects.filter(patient_id__in=deleted).delete()
+
+    updates = [obj for is_delete, obj in changes.values() if not is_delete]
+    existing = dict((patient.patient_id, patient) for patient in
+                    Patient.objects.filter(patient_id__in=[obj['id'] for obj in updates]))
+    new_patients = []
+    for obj in updates:
+        patient_obj = existing.get(obj['id']) or Patient(patient_id=obj['id'])
+        patient_obj.doctor_id = obj['doctor']
+        patient_obj.gender = obj.get('gender') or patient_obj.gender
+        patient_obj.first_name = obj.get('first_name') or ''
+        patient_obj.last_name = obj.get('last_name') or ''
+        patient_obj.email = obj.get('email') or ''
+        if patient_obj.pk:
+            patient_obj.save()
+        else:
+            new_patients.append(patient_obj)
+    Patient.objects.bulk_create(new_patients)
+
+
+def is_behind(status, current_status):
+    if status not in VISIT_PROGRESS or current_status not in VISIT_PROGRESS:
+        return False
+    return VISIT_PROGRESS.index(status) < VISIT_PROGRESS.index(current_status)
+
+
+def apply_appointment_changes(changes):
+    deleted = [appointment_id for appointment_id, (is_delete, _) in changes.items() if is_delete]
+    if deleted:
+        Appointment.objects.filter(appointment_id__in=deleted).delete()
+        Arrival.objects.filter(appointment_id__in=deleted).delete()
+
+    updates = [obj for is_delete, obj in changes.values() if not is_delete]
+    if not updates:
+        return
+
+    # appointments may arrive before their patient has been synced; create a bare record to hang them on
+    patient_ids = set(obj['patient'] for obj in updates)
+    patients = dict((patient.patient_id, patient) for patient in Patient.objects.filter(patient_id__in=patient_ids))
+    missing = [Patient(patient_id=obj['patient'], doctor_id=obj['doctor']) for obj in
+               dict((obj['patient'], obj) for obj in updates if obj['patient'] not in patients).values()]
+    if missing:
+        Patient.objects.bulk_create(missing)
+        patients.update((patient.patient_id, patient) for patient in
+                        Patient.objects.filter(patient_id__in=[patient.patient_id for patient in missing]))
+
+    existing = dict((appointment.appointment_id, appointment) for appointment in
+                    Appointment.objects.filter(appointment_id__in=[str(obj['id']) for obj in updates]))
+    new_appointments = []
+    for obj in updates:
+        appointment_obj = existing.get(str(obj['id'])) or Appointment(appointment_id=str(obj['id']))
+        status = obj.get('status') or ''
+        if is_behind(status, appointment_obj.status):
+            status = appointment_obj.status
+        arrived_now = status == 'Arrived' and appointment_obj.status != 'Arrived'
+
+        appointment_obj.patient = patients[obj['patient']]
+        appointment_obj.doctor_id = obj['doctor']
+        appointment_obj.status = status
+        appointment_obj.scheduled_time = obj.get('scheduled_time') or appointment_obj.scheduled_time
+        appointment_obj.duration = obj.get('duration') or appointment_obj.duration
+
+        # patients marked arrived upstream (e.g. at the front desk) show up on the dashboard's next poll
+        if arrived_now:
+            appointment_obj.arrival_time = appointment_obj.arrival_time or timezone.now()
+            Arrival.objects.get_or_create(appointment_id=appointment_obj.appointment_id,
+                                          doctor_id=appointment_obj.doctor_id)
+
+        if appointment_obj.pk:
+            appointment_obj.save()
+        else:
+            new_appointments.append(appointment_obj)
+    Appointment.objects.bulk_create(new_appointments)
@@ -1,8 +1,10 @@
-import os
+import logging
 
 import requests
 from social.backends.oauth import BaseOAuth2
 
+log = logging.getLogger(__name__)
+
 
 class drchronoOAuth2(BaseOAuth2):
     """
@@ -31,7 +33,7 @@ class drchronoOAuth2(BaseOAuth2):
         doctors_url = 'https://drchrono.com/api/doctors'
         while doctors_url:
             resp = requests.get(doctors_url, headers=auth_header).json()
-            print("Hello", resp)
+            log.debug("Fetched page of %d doctors", len(resp['results']))
             for doctor in resp['results']:
                 if doctor['id'] == response.get('doctor'):
                     return {